@@ -0,0 +1,164 @@
+import argparse
+import json
+import platform
+import time
+from math import pi, cos, sin
+
+import numpy as np
+import pygame
+from game import Game, W3DException
+from parallel import ParallelRenderer
+from profiler import stats, offscreen_surface
+from renderer import Renderer, RENDER_MODES
+
+# default resolutions of the benchmark (width, height)
+RESOLUTIONS = [(320, 200), (640, 400), (1280, 800)]
+# names of the timed rendering stages, in the order in which they are executed
+STAGES = ['cast', 'fill', 'floor', 'sprites', 'blit']
+
+
+def camera_path(game, frames):
+    """
+    Deterministic list of camera positions for a level: a full turn on the starting position, followed by views from
+    evenly spaced floor cells of the level in 8 directions
+    :param game: game with the level loaded
+    :param frames: number of camera positions
+    :return: list of (x, y, dx, dy) tuples
+    """
+    player = game.player
+    start_angle = np.arctan2(player.dy, player.dx)
+    nb_turn = frames // 2
+    path = []
+    for i in range(nb_turn):
+        angle = start_angle + 2 * pi * i / nb_turn
+        path.append((player.x, player.y, cos(angle), sin(angle)))
+    # floor cells have plane0 values 106 and above
+    cells = game.map.find_cell(values0=range(106, 144))
+    nb_views = frames - nb_turn
+    nb_cells = max(nb_views // 8, 1)
+    for i in range(nb_views):
+        x, y = cells[(i // 8) % nb_cells * len(cells) // nb_cells]
+        angle = pi * (i % 8) / 4
+        path.append((x + .5, y + .5, cos(angle), sin(angle)))
+    return path
+
+
+def benchmark_level(game, renderer, screen, frames):
+    """
+    Render all the frames of the camera path of the level currently loaded, timing each rendering stage separately
+    :param game: game with the level loaded
+    :param renderer: renderer to use
+    :param screen: surface on which frames are blitted
+    :param frames: number of frames to render
+    :return: dictionary of statistics for each stage and for the whole frame
+    """
+    timings = {stage: [] for stage in STAGES + ['frame']}
+    player = game.player
+    for player.x, player.y, player.dx, player.dy in camera_path(game, frames):
+        t0 = time.perf_counter()
+        renderer.cast(game)
+        t1 = time.perf_counter()
+        renderer.fill()
+        t2 = time.perf_counter()
+        renderer.draw_floor(game)
+        t3 = time.perf_counter()
+        renderer.draw_sprites(game)
+        t4 = time.perf_counter()
+        renderer.blit(screen)
+        t5 = time.perf_counter()
+        for stage, duration in zip(STAGES + ['frame'], [t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t5 - t0]):
+            timings[stage].append(duration)
+    return {stage: stats(samples) for stage, samples in timings.items()}
+
+
+def run_benchmark(levels, resolutions, frames, workers=0, threads=False, modes=('flat',)):
+    """
+    Run the rendering benchmark on a set of levels and resolutions
+    :param levels: indexes of the levels
+    :param resolutions: list of (width, height) resolutions
+    :param frames: number of frames rendered for each level and resolution
+    :param workers: number of workers rendering strips of the screen in parallel (0 to render in the main process)
+    :param threads: whether the workers are threads instead of processes
+    :param modes: render modes to compare (see renderer.RENDER_MODES)
+    :return: dictionary of results (can be saved as JSON)
+    """
+    results = []
+    configurations = [(mode, width, height) for mode in modes for width, height in resolutions]
+    screens = [offscreen_surface(width, height) for mode, width, height in configurations]
+    if workers > 0:
+        renderers = [ParallelRenderer(width, height, workers=workers, threads=threads, mode=mode)
+                     for mode, width, height in configurations]
+    else:
+        renderers = [Renderer(width, height, mode=mode) for mode, width, height in configurations]
+    for level in levels:
+        game = Game()
+        try:
+            game.load_level(level)
+        except W3DException:
+            continue
+        for (mode, width, height), renderer, screen in zip(configurations, renderers, screens):
+            result = benchmark_level(game, renderer, screen, frames)
+            results.append({'level': level, 'name': game.map.name, 'mode': mode, 'width': width, 'height': height,
+                            'stages': result})
+    if workers > 0:
+        for renderer in renderers:
+            renderer.close()
+    return {
+        'system': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'frames': frames,
+        'workers': workers,
+        'modes': list(modes),
+        'threads': threads,
+        'results': results,
+    }
+
+
+def print_summary(report):
+    """
+    Print the average frame time of each stage, for each render mode and resolution
+    :param report: benchmark results (as returned by `run_benchmark`)
+    """
+    configurations = sorted({(RENDER_MODES.index(r['mode']), r['width'], r['height']) for r in report['results']})
+    print('{:>10}{:>10} '.format('mode', 'size') + ''.join('{:>10}'.format(s) for s in STAGES + ['frame', 'fps']))
+    for mode_index, width, height in configurations:
+        mode = RENDER_MODES[mode_index]
+        results = [r for r in report['results'] if (r['mode'], r['width'], r['height']) == (mode, width, height)]
+        means = [np.mean([r['stages'][s]['mean'] for r in results]) for s in STAGES + ['frame']]
+        print('{:>10}{:>10} '.format(mode, '{}x{}'.format(width, height)) +
+              ''.join('{:>10.2f}'.format(m) for m in means) + '{:>10.0f}'.format(1000 / means[-1]))
+
+
+def parse_resolution(value):
+    """
+    Parse a resolution given as a string "WIDTHxHEIGHT"
+    :param value: string to parse
+    :return: a pair (width, height)
+    """
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless rendering benchmark (all times in milliseconds)")
+    parser.add_argument('-l', '--levels', type=int, nargs='+', default=list(range(60)), help="indexes of levels")
+    parser.add_argument('-r', '--resolutions', type=parse_resolution, nargs='+', default=RESOLUTIONS,
+                        help="resolutions as WIDTHxHEIGHT")
+    parser.add_argument('-f', '--frames', type=int, default=100, help="number of frames per level and resolution")
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help="number of parallel workers (the cast stage then includes the fill stage)")
+    parser.add_argument('--threads', action='store_true', help="use threads instead of processes as workers")
+    parser.add_argument('-m', '--modes', nargs='+', choices=RENDER_MODES, default=['flat'],
+                        help="render modes of the ceiling and the floor")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="JSON file where results are saved")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.levels, args.resolutions, args.frames, args.workers, args.threads, args.modes)
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    print_summary(report)
@@ -0,0 +1,80 @@
+import mmap
+import struct
+import numpy as np
+from files import atomic_open
+
+# first bytes of bundle files, and version of the format
+MAGIC = b'W3DB'
+VERSION = 1
+# header: magic, version, number of arrays
+HEADER = struct.Struct('<4sHH')
+# index entry of an array: name, dtype, number of dimensions, shape (up to 4 dimensions), offset of the data
+ENTRY = struct.Struct('<24s8sB4IQ')
+MAX_DIMENSIONS = 4
+# data of each array starts at a multiple of this number of bytes
+ALIGNMENT = 64
+
+
+class BundleException(Exception):
+    pass
+
+
+def write_bundle(filename, arrays):
+    """
+    Write arrays in a bundle file: a header, an index of the arrays and the raw data of each array (aligned so that
+    arrays can be used directly from a memory-mapped file)
+    :param filename: path of the file to create
+    :param arrays: dictionary of arrays by name (names are at most 24 ASCII characters long, arrays have at most 4
+    dimensions)
+    """
+    index = []
+    offset = HEADER.size + ENTRY.size * len(arrays)
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.ndim > MAX_DIMENSIONS:
+            raise BundleException("Too many dimensions for array {}".format(name))
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        index.append((name, array, offset))
+        offset += array.nbytes
+
+    with atomic_open(filename) as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, len(index)))
+        for name, array, offset in index:
+            shape = array.shape + (0,) * (MAX_DIMENSIONS - array.ndim)
+            fp.write(ENTRY.pack(name.encode('ascii'), array.dtype.str.encode('ascii'), array.ndim, *shape, offset))
+        for name, array, offset in index:
+            fp.write(bytes(offset - fp.tell()))
+            fp.write(array.tobytes())
+
+
+class Bundle:
+    """
+    Arrays of a bundle file (see `write_bundle`). The file is memory-mapped and arrays are read-only views on its data.
+    """
+    def __init__(self, filename):
+        """
+        Initializer
+        :param filename: path of the bundle file
+        """
+        with open(filename, 'rb') as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, nb_arrays = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise BundleException("Not a bundle file (or unsupported version): {}".format(filename))
+        self.arrays = {}
+        for i in range(nb_arrays):
+            name, dtype, ndim, *shape, offset = ENTRY.unpack_from(self.data, HEADER.size + i * ENTRY.size)
+            self.arrays[name.rstrip(b'\0').decode('ascii')] = np.frombuffer(
+                self.data, dtype=np.dtype(dtype.rstrip(b'\0').decode('ascii')), count=int(np.prod(shape[:ndim])),
+                offset=offset).reshape(shape[:ndim])
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name):
+        """
+        Array of the bundle
+        :param name: name of the array
+        :return: a read-only array
+        """
+        return self.arrays[name]
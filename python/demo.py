@@ -0,0 +1,355 @@
+import argparse
+import glob
+import json
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from math import atan2, pi
+
+import numpy as np
+import pygame
+from game import Game, TICK_RATE, ACTION_FORWARD, ACTION_TURN_LEFT, ACTION_TURN_RIGHT, ACTION_USE, ELEVATOR_TILE, \
+    SECRET_ELEVATOR_TILE
+from profiler import stats, offscreen_surface, PERCENTILES
+from renderer import Renderer, RENDER_MODES
+
+# first bytes of demo files, and version of the format
+MAGIC = b'W3DM'
+VERSION = 1
+# header: magic, version, tick rate, index of the first level, number of ticks and state of the game after the last
+# tick (level, x, y, dx, dy), followed by the zlib-compressed actions of each tick (one byte per tick)
+HEADER = struct.Struct('<4sHHHIH4d')
+# directory of the demos shipped with the game
+DEMO_DIR = 'demos'
+# levels of the shipped demos (one demo for each level of the first episode)
+DEMO_LEVELS = list(range(10))
+# longest duration of a generated demo in ticks (three minutes of game time)
+MAX_DEMO_TICKS = 180 * TICK_RATE
+# largest difference between the recorded and replayed final positions of the player
+SYNC_TOLERANCE = 1e-6
+# plane0 values of doors that can be opened without keys (normal and elevator doors)
+UNLOCKED_DOORS = [90, 91, 100, 101]
+
+
+class DemoException(Exception):
+    pass
+
+
+def game_state(game):
+    """
+    State of the game compared at the end of replays to check that they did not diverge from the recording
+    :param game: game
+    :return: tuple (level, x, y, dx, dy)
+    """
+    player = game.player
+    return game.map.level, player.x, player.y, player.dx, player.dy
+
+
+class Demo:
+    """
+    Actions of the player recorded at each tick from the start of a level. The game only depends on these actions, so
+    replaying them gives the same game (and renders the same frames) on every run.
+    """
+    def __init__(self, level=0, actions=(), final_state=None):
+        """
+        Initializer
+        :param level: index of the level where the demo starts
+        :param actions: actions of the player at each tick (combinations of game.ACTION_* flags)
+        :param final_state: state of the game after the last tick (see `game_state`), None if unknown
+        """
+        self.level = level
+        self.actions = list(actions)
+        self.final_state = final_state
+
+    def __len__(self):
+        return len(self.actions)
+
+    def record(self, actions):
+        """
+        Add the actions of a tick
+        :param actions: combination of game.ACTION_* flags
+        """
+        self.actions.append(actions)
+
+    def save(self, filename, game):
+        """
+        Write the demo to a file
+        :param filename: path of the file to create
+        :param game: game in which the demo was recorded, its current state is saved to check replays
+        """
+        self.final_state = game_state(game)
+        with open(filename, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, TICK_RATE, self.level, len(self.actions), *self.final_state))
+            fp.write(zlib.compress(np.array(self.actions, dtype=np.uint8).tobytes(), 9))
+
+    def in_sync(self, game):
+        """
+        Whether a replay reached the state of the game at the end of the recording
+        :param game: game after the replay of all the ticks of the demo
+        :return: True if the states match (or if the final state of the demo is unknown)
+        """
+        if self.final_state is None:
+            return True
+        level, *position = game_state(game)
+        return level == self.final_state[0] and np.allclose(position, self.final_state[1:], rtol=0,
+                                                            atol=SYNC_TOLERANCE)
+
+
+def load_demo(filename):
+    """
+    Read a demo file
+    :param filename: path of the file
+    :return: a `Demo` instance
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    magic, version, tick_rate, level, nb_ticks, *final_state = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise DemoException("Not a demo file (or unsupported version): {}".format(filename))
+    if tick_rate != TICK_RATE:
+        raise DemoException("Demo recorded at {} ticks per second instead of {}: {}".format(
+            tick_rate, TICK_RATE, filename))
+    actions = np.frombuffer(zlib.decompress(data[HEADER.size:]), dtype=np.uint8)
+    if len(actions) != nb_ticks:
+        raise DemoException("Truncated demo file: {}".format(filename))
+    return Demo(level, actions.tolist(), tuple(final_state))
+
+
+def replay(game, demo, renderer=None, screen=None, window=False, frame_ticks=1):
+    """
+    Replay a demo as fast as possible, rendering a frame every frame_ticks ticks (the frames do not depend on the speed
+    of the machine, so that every replay renders the same frames)
+    :param game: game in which the demo is replayed (the level of the demo is loaded)
+    :param demo: demo to replay
+    :param renderer: renderer used to draw the frames (nothing is rendered if None)
+    :param screen: surface on which frames are drawn (frames are only rendered to the framebuffer if None)
+    :param window: whether screen is the display surface (it is then flipped after each frame, and the replay stops
+    if the window is closed)
+    :param frame_ticks: number of ticks between two frames
+    :return: a pair (durations, interrupted) where durations is the array of the durations of the frames in seconds
+    (empty if nothing is rendered) and interrupted indicates whether the window was closed before the end of the demo
+    """
+    game.load_level(demo.level)
+    durations = np.zeros(len(demo) // frame_ticks if renderer is not None else 0)
+    for tick, actions in enumerate(demo.actions):
+        game.tick(actions)
+        i, remainder = divmod(tick + 1, frame_ticks)
+        if renderer is None or remainder != 0:
+            continue
+        start = time.perf_counter()
+        if screen is None:
+            renderer.render(game)
+        else:
+            renderer.draw(game, screen)
+        if window:
+            pygame.display.flip()
+        durations[i - 1] = time.perf_counter() - start
+        if window and pygame.event.peek(pygame.QUIT):
+            return durations[:i], True
+    return durations, False
+
+
+def print_header():
+    """
+    Print the column names of the lines printed by `print_report`
+    """
+    print('{:<16}{:>8}'.format('demo', 'ticks') +
+          ''.join('{:>10}'.format(key) for key in ['mean'] + ['p{}'.format(p) for p in PERCENTILES] + ['max']))
+
+
+def print_report(name, ticks, durations, in_sync):
+    """
+    Print the distribution of the frame times of a replay
+    :param name: name of the demo
+    :param ticks: number of replayed ticks
+    :param durations: durations of the frames in seconds (as returned by `replay`)
+    :param in_sync: whether the replay reached the recorded final state
+    """
+    line = '{:<16}{:>8}'.format(name, ticks)
+    if len(durations) > 0:
+        frame_stats = stats(durations)
+        line += ''.join('{:>10.2f}'.format(frame_stats[key])
+                        for key in ['mean'] + ['p{}'.format(p) for p in PERCENTILES] + ['max'])
+    print(line + ('' if in_sync else '  DESYNC'))
+
+
+class Autopilot:
+    """
+    Policy used to generate demos (see `Game.run`): the player walks along a shortest path to the closest elevator
+    switch (opening doors on the way) and uses it. Levels where no switch can be reached without keys or secret
+    passages are explored up to the farthest reachable cell instead.
+    """
+    def __init__(self):
+        self.map = None
+        # cells left on the path, and direction of the elevator switch at the end of the path
+        self.path = deque()
+        self.switch = None
+        self.done = False
+
+    def plan(self, game):
+        """
+        Compute the path to follow in the current level of the game
+        :param game: game
+        """
+        level_map = game.map
+        self.map = level_map
+        self.done = False
+        passable = ~level_map.blocking | np.isin(level_map.plane0, UNLOCKED_DOORS)
+        start = int(game.player.x), int(game.player.y)
+        previous = {start: None}
+        queue = deque([start])
+        goal = start
+        self.switch = None
+        while queue:
+            x, y = cell = queue.popleft()
+            goal = cell
+            if level_map.plane0[x, y] != SECRET_ELEVATOR_TILE:
+                switches = [dx for dx in (-1, 1) if level_map.plane0[x + dx, y] == ELEVATOR_TILE]
+                if switches:
+                    self.switch = switches[0]
+                    break
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if (nx, ny) not in previous and passable[nx, ny]:
+                    previous[nx, ny] = cell
+                    queue.append((nx, ny))
+        # the last cell dequeued is the switch cell or the farthest reachable cell
+        self.path.clear()
+        cell = goal
+        while cell != start:
+            self.path.appendleft(cell)
+            cell = previous[cell]
+
+    def face(self, player, angle):
+        """
+        Actions turning the player towards a direction
+        :param player: player
+        :param angle: target direction in radians
+        :return: a pair (actions, difference between the target and the current direction)
+        """
+        difference = (angle - atan2(player.dy, player.dx) + pi) % (2 * pi) - pi
+        if difference > player.speed_angle / 2:
+            return ACTION_TURN_RIGHT, difference
+        if difference < -player.speed_angle / 2:
+            return ACTION_TURN_LEFT, difference
+        return 0, difference
+
+    def __call__(self, game):
+        """
+        Actions of the player for the next tick
+        :param game: game
+        :return: combination of game.ACTION_* flags
+        """
+        if game.map is not self.map:
+            self.plan(game)
+        player = game.player
+        while self.path and abs(self.path[0][0] + .5 - player.x) + abs(self.path[0][1] + .5 - player.y) < .15:
+            self.path.popleft()
+        if not self.path:
+            if self.switch is None:
+                self.done = True
+                return 0
+            actions, difference = self.face(player, 0 if self.switch > 0 else pi)
+            # the switch is used as soon as the player faces it (the use action is only triggered when pressed)
+            if actions == 0 and not game.actions & ACTION_USE:
+                actions = ACTION_USE
+            return actions
+        x, y = self.path[0]
+        actions, difference = self.face(player, atan2(y + .5 - player.y, x + .5 - player.x))
+        if game.map.blocking[x, y]:
+            # closed door on the path, opened when the player stands in front of it
+            if actions == 0 and not game.actions & ACTION_USE and \
+                    abs(x + .5 - player.x) + abs(y + .5 - player.y) < 1.2:
+                actions = ACTION_USE
+        elif abs(difference) < .5:
+            actions |= ACTION_FORWARD
+        return actions
+
+
+def generate_demo(level, max_ticks=MAX_DEMO_TICKS):
+    """
+    Record a demo of the autopilot playing a level, until it uses an elevator or has nowhere left to go
+    :param level: index of the level
+    :param max_ticks: longest duration of the demo in ticks
+    :return: a pair (demo, game) where game is the game after the last tick of the demo
+    """
+    game = Game()
+    game.load_level(level)
+    demo = Demo(level)
+    autopilot = Autopilot()
+    while len(demo) < max_ticks and game.map.level == level:
+        actions = autopilot(game)
+        if autopilot.done:
+            break
+        demo.record(actions)
+        game.tick(actions)
+    return demo, game
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay demos and report the distribution of frame times (all times "
+                                                 "in milliseconds)")
+    parser.add_argument('demos', nargs='*', help="demo files (defaults to all the shipped demos)")
+    parser.add_argument('--width', type=int, default=640, help="width of the frames")
+    parser.add_argument('--height', type=int, default=400, help="height of the frames")
+    parser.add_argument('-m', '--mode', choices=RENDER_MODES, default='flat',
+                        help="way of drawing the ceiling and the floor")
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help="number of processes rendering strips of the screen in parallel")
+    parser.add_argument('-f', '--frame-ticks', type=int, default=1, help="number of ticks between two frames")
+    parser.add_argument('--window', action='store_true', help="display the frames in a window")
+    parser.add_argument('--no-render', action='store_true', help="only simulate the game (checks synchronization)")
+    parser.add_argument('-o', '--output', help="JSON file where frame statistics are saved")
+    parser.add_argument('--generate', action='store_true', help="record the shipped demos with the autopilot")
+    args = parser.parse_args()
+
+    if args.generate:
+        os.makedirs(DEMO_DIR, exist_ok=True)
+        for level in DEMO_LEVELS:
+            demo, game = generate_demo(level)
+            filename = os.path.join(DEMO_DIR, 'e1m{:02}.demo'.format(level + 1))
+            demo.save(filename, game)
+            print("{}: {} ticks, ends in level {}".format(filename, len(demo), game.map.level))
+        raise SystemExit
+
+    if args.window:
+        pygame.init()
+        screen = pygame.display.set_mode((args.width, args.height))
+    else:
+        screen = offscreen_surface(args.width, args.height)
+    if args.no_render:
+        renderer = None
+    elif args.workers > 0:
+        from parallel import ParallelRenderer
+        renderer = ParallelRenderer(args.width, args.height, workers=args.workers, mode=args.mode)
+    else:
+        renderer = Renderer(args.width, args.height, mode=args.mode)
+
+    filenames = args.demos or sorted(glob.glob(os.path.join(DEMO_DIR, '*.demo')))
+    results = []
+    all_durations = []
+    ticks = 0
+    print_header()
+    for filename in filenames:
+        demo = load_demo(filename)
+        game = Game()
+        durations, interrupted = replay(game, demo, renderer, screen, args.window, args.frame_ticks)
+        # replays interrupted by closing the window are not checked
+        in_sync = interrupted or demo.in_sync(game)
+        name = os.path.splitext(os.path.basename(filename))[0]
+        print_report(name, len(demo), durations, in_sync)
+        all_durations.append(durations)
+        ticks += len(demo)
+        results.append({'demo': name, 'ticks': len(demo), 'in_sync': in_sync,
+                        'frames': stats(durations) if len(durations) > 0 else None})
+    all_durations = np.concatenate(all_durations) if all_durations else np.zeros(0)
+    if len(filenames) > 1:
+        print_report('all', ticks, all_durations, all(result['in_sync'] for result in results))
+    if args.workers > 0 and renderer is not None:
+        renderer.close()
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'width': args.width, 'height': args.height, 'mode': args.mode, 'workers': args.workers,
+                       'frame_ticks': args.frame_ticks, 'results': results,
+                       'frames': stats(all_durations) if len(all_durations) > 0 else None}, fp, indent=2)
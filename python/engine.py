@@ -1,3 +1,10 @@
+import numpy as np
+from game import WALL, DOOR, PUSHWALL
+
+# textures of doors (indexed by plane0 value - 90), the walls on the sides of NS and EW doors use textures 100 and 101
+DOOR_TEXTURES = np.array([99, 98, 105, 104, 105, 104, 99, 98, 99, 98, 103, 102])
+
+
 def cast_ray(level_map, px, py, rdx, rdy):
     stepx = 1 if rdx >= 0 else -1
     stepy = 1 if rdy >= 0 else -1
@@ -54,3 +61,189 @@ def cast_ray(level_map, px, py, rdx, rdy):
     ry = cy + 1 - rfy if stepy > 0 else cy + rfy
 
     return (rx, ry, t, texture_index, tx)
+
+
+def cast_rays(level_map, px, py, rdx, rdy):
+    """
+    Cast a batch of rays from the same origin, stepping all of them together through the level grid
+    (same algorithm as `cast_ray`, applied to each ray). Doors and moving pushwalls are only handled for the rays
+    that are in cells flagged as such in `level_map.kind`, so that other rays only test if they hit a wall.
+    :param level_map: the level data (a `game.Map` instance)
+    :param px: x-coordinate of the origin of the rays
+    :param py: y-coordinate of the origin of the rays
+    :param rdx: array of x-values of the rays directions
+    :param rdy: array of y-values of the rays directions
+    :return: arrays rx, ry, t, texture_index, tx (one value for each ray)
+    """
+    kind = level_map.kind
+    plane0 = level_map.plane0
+    rdx = np.asarray(rdx, dtype=np.float64)
+    rdy = np.asarray(rdy, dtype=np.float64)
+    n = len(rdx)
+
+    stepx = np.where(rdx >= 0, 1, -1)
+    stepy = np.where(rdy >= 0, 1, -1)
+    rdx = rdx * stepx
+    rdy = rdy * stepy
+
+    cx = np.full(n, int(px))
+    cy = np.full(n, int(py))
+
+    rfx = np.where(stepx > 0, 1 - (px % 1), px % 1)
+    rfy = np.where(stepy > 0, 1 - (py % 1), py % 1)
+    on_edge = rfx == 0
+    rfx[on_edge] = 1
+    cx[on_edge] += stepx[on_edge]
+    on_edge = rfy == 0
+    rfy[on_edge] = 1
+    cy[on_edge] += stepy[on_edge]
+
+    t = np.zeros(n)
+    texture_index = np.zeros(n, dtype=np.int64)
+    tx = np.zeros(n)
+    rays = (cx, cy, rfx, rfy, rdx, rdy, stepx, stepy, t, texture_index, tx)
+
+    # indexes of the rays that haven't hit a wall yet
+    active = np.arange(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while active.size > 0:
+            cell_kind = kind[cx[active], cy[active]]
+            hit = cell_kind == WALL
+            if hit.any():
+                # rays that hit a wall
+                h = active[hit]
+                m0_hit = plane0[cx[h], cy[h]].astype(np.int64)
+                ns = rfx[h] == 1
+                same_sign = stepx[h] * stepy[h] > 0
+                texture_index[h] = np.where(ns, 2 * m0_hit - 1, 2 * m0_hit - 2)
+                # fix texture orientation depending on ray direction
+                tx[h] = np.where(
+                    ns,
+                    np.where(same_sign, 1 - rfy[h], rfy[h]),
+                    np.where(same_sign, rfx[h], 1 - rfx[h]))
+            if cell_kind.max() >= DOOR:
+                # rays in door or moving pushwall cells that do not hit them continue as in an empty cell
+                door = cell_kind == DOOR
+                if door.any():
+                    hit[door] = cross_doors(level_map, rays, active[door])
+                pushwall = cell_kind == PUSHWALL
+                if pushwall.any():
+                    hit[pushwall] = cross_pushwalls(level_map, rays, active[pushwall])
+            active = active[~hit]
+
+            # move remaining rays to the next cell
+            horizontal = rfx[active] * rdy[active] <= rfy[active] * rdx[active]
+            h = active[horizontal]
+            dt = rfx[h] / rdx[h]
+            t[h] += dt
+            rfx[h] = 1
+            cx[h] += stepx[h]
+            rfy[h] -= dt * rdy[h]
+
+            v = active[~horizontal]
+            dt = rfy[v] / rdy[v]
+            t[v] += dt
+            rfy[v] = 1
+            cy[v] += stepy[v]
+            rfx[v] -= dt * rdx[v]
+
+    # compute rays locations
+    rx = np.where(stepx > 0, cx + 1 - rfx, cx + rfx)
+    ry = np.where(stepy > 0, cy + 1 - rfy, cy + rfy)
+
+    return rx, ry, t, texture_index, tx
+
+
+def cross_doors(level_map, rays, d):
+    """
+    Test if rays in door cells hit the door or the walls on the sides of the door. The door is in the middle of its
+    cell and slides sideways when it opens (by the offset of its slot in `level_map.offset`).
+    NS doors (even plane0 values) are crossed along the x-axis and EW doors along the y-axis: the tests are written
+    for NS doors, with the axes swapped for EW doors (a is the axis across the door, b the axis along the door).
+    :param level_map: the level data (a `game.Map` instance)
+    :param rays: state arrays of all rays (cx, cy, rfx, rfy, rdx, rdy, stepx, stepy, t, texture_index, tx), the
+    values of the rays that hit something are updated
+    :param d: indexes of the rays that are in a door cell
+    :return: array of booleans indicating which rays hit something
+    """
+    cx, cy, rfx, rfy, rdx, rdy, stepx, stepy, t, texture_index, tx = rays
+    m0 = level_map.plane0[cx[d], cy[d]].astype(np.intp)
+    offset = level_map.offset[level_map.slot[cx[d], cy[d]]]
+    ns = m0 % 2 == 0
+    a = np.where(ns, rfx[d], rfy[d])
+    b = np.where(ns, rfy[d], rfx[d])
+    da = np.where(ns, rdx[d], rdy[d])
+    db = np.where(ns, rdy[d], rdx[d])
+    sa = np.where(ns, stepx[d], stepy[d])
+    sb = np.where(ns, stepy[d], stepx[d])
+
+    # the ray reaches the middle of the cell and the part of the door that is not open
+    dt_door = (a - .5) / da
+    b_door = b - dt_door * db
+    tx_door = np.where(sb > 0, 1 - b_door, b_door) - offset
+    hit_door = (a >= .5) & ((a - .5) * db < b * da) & (tx_door >= 0)
+    # otherwise the ray hits the wall on the side of the door if it leaves the cell along the door
+    hit_side = ~hit_door & (a * db >= b * da)
+    hit = hit_door | hit_side
+
+    dt = np.where(hit_door, dt_door, b / db)
+    a = np.where(hit_door, .5, a - dt * da)
+    b = np.where(hit_door, b_door, 0)
+    h = d[hit]
+    t[h] += dt[hit]
+    rfx[h] = np.where(ns, a, b)[hit]
+    rfy[h] = np.where(ns, b, a)[hit]
+    texture_index[h] = np.where(hit_door, DOOR_TEXTURES[m0 - 90], np.where(ns, 100, 101))[hit]
+    tx[h] = np.where(hit_door, tx_door, np.where(sa > 0, 1 - a, a))[hit]
+    return hit
+
+
+def cross_pushwalls(level_map, rays, p):
+    """
+    Test if rays in the cells of moving pushwalls hit the wall. The wall has moved by the offset of its slot in
+    `level_map.offset` in the direction given by `level_map.direction` and only covers the end of its cell (the part
+    of the wall that is already in the next cell is not drawn).
+    The tests are written for walls moving along the x-axis, with the axes swapped for walls moving along the y-axis
+    (a is the axis along which the wall moves, b the other axis).
+    :param level_map: the level data (a `game.Map` instance)
+    :param rays: state arrays of all rays (cx, cy, rfx, rfy, rdx, rdy, stepx, stepy, t, texture_index, tx), the
+    values of the rays that hit the wall are updated
+    :param p: indexes of the rays that are in a moving pushwall cell
+    :return: array of booleans indicating which rays hit the wall
+    """
+    cx, cy, rfx, rfy, rdx, rdy, stepx, stepy, t, texture_index, tx = rays
+    m0 = level_map.plane0[cx[p], cy[p]].astype(np.int64)
+    slot = level_map.slot[cx[p], cy[p]]
+    offset = level_map.offset[slot]
+    direction = level_map.direction[slot]
+    along_x = direction[:, 0] != 0
+    a = np.where(along_x, rfx[p], rfy[p])
+    b = np.where(along_x, rfy[p], rfx[p])
+    da = np.where(along_x, rdx[p], rdy[p])
+    db = np.where(along_x, rdy[p], rdx[p])
+    forward = np.where(along_x, stepx[p] == direction[:, 0], stepy[p] == direction[:, 1])
+
+    # position of the ray in the cell, measured in the direction of the wall movement (the wall covers [offset, 1])
+    inside = np.where(forward, 1 - a, a) >= offset
+    # a ray moving in the same direction as the wall reaches its face if it does not leave the cell by a side before
+    dt_face = (a - (1 - offset)) / da
+    front = ~inside & forward & (dt_face * db <= b)
+    hit = inside | front
+
+    dt = np.where(front, dt_face, 0)
+    a = np.where(front, 1 - offset, a)
+    b = b - dt * db
+    h = p[hit]
+    t[h] += dt[hit]
+    rfx[h] = np.where(along_x, a, b)[hit]
+    rfy[h] = np.where(along_x, b, a)[hit]
+    # the face of the wall that is hit is across the x-axis (NS wall) or across the y-axis (EW wall)
+    face_a = front | (a == 1)
+    ns = np.where(along_x, face_a, ~face_a)[hit]
+    same_sign = stepx[h] * stepy[h] > 0
+    texture_index[h] = np.where(ns, 2 * m0[hit] - 1, 2 * m0[hit] - 2)
+    tx[h] = np.where(
+        ns,
+        np.where(same_sign, 1 - rfy[h], rfy[h]),
+        np.where(same_sign, rfx[h], 1 - rfx[h]))
+    return hit
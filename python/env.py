@@ -0,0 +1,231 @@
+import os
+from functools import lru_cache
+from multiprocessing import Pipe, Process, shared_memory
+
+import numpy as np
+from game import Game, Level
+from renderer import Renderer, load_textures
+
+# values of the player state vector of observations
+STATE_FIELDS = ['x', 'y', 'dx', 'dy', 'kills', 'treasures', 'secrets']
+# default length of an episode in ticks (one minute of game time)
+MAX_TICKS = 4200
+
+
+@lru_cache(maxsize=None)
+def prepared_level(level):
+    """
+    Level prepared once and copied at the start of each episode (prepared before the workers of a `VectorEnvironment`
+    are started, it is shared by all processes)
+    :param level: index of the level
+    :return: a `game.Level` instance that must not be played directly (see `game.Level.copy`)
+    """
+    return Level(level)
+
+
+class Environment:
+    """
+    Headless game for automated agents: each step applies the actions of the player for some ticks and returns an
+    observation made of a small rendered frame and of the player's state
+    """
+    def __init__(self, level=0, width=80, height=50, render=True, frame_skip=1, max_ticks=MAX_TICKS):
+        """
+        Initializer
+        :param level: index of the level played in each episode
+        :param width: width of the observed frames in pixels
+        :param height: height of the observed frames in pixels
+        :param render: whether frames are rendered (observed frames are None otherwise)
+        :param frame_skip: number of ticks simulated at each step (with the same actions)
+        :param max_ticks: number of ticks after which an episode is over
+        """
+        self.level = level
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        self.game = Game()
+        self.renderer = Renderer(width, height) if render else None
+        self.state = np.zeros(len(STATE_FIELDS))
+
+    def observe(self):
+        """
+        Current observation of the environment
+        :return: a pair (frame, state) where frame is the rendered frame (palette indexes indexed as frame[x, y], the
+        array is reused by the next steps) and state is an array of the values in STATE_FIELDS
+        """
+        player = self.game.player
+        score = player.score
+        self.state[:] = player.x, player.y, player.dx, player.dy, score.kills, score.treasures, score.secrets
+        if self.renderer is None:
+            return None, self.state
+        self.renderer.render(self.game)
+        return self.renderer.framebuffer, self.state
+
+    def reset(self):
+        """
+        Start a new episode
+        :return: the first observation of the episode (see `observe`)
+        """
+        self.game.start_level(prepared_level(self.level).copy())
+        return self.observe()
+
+    def step(self, actions):
+        """
+        Advance the game
+        :param actions: actions of the player (combination of game.ACTION_* flags)
+        :return: tuple (observation, reward, done) where reward is the number of kills, treasures and secrets found
+        during the step and done indicates whether the episode is over
+        """
+        score = self.game.player.score
+        points = score.kills + score.treasures + score.secrets
+        for _ in range(self.frame_skip):
+            self.game.tick(actions)
+        reward = score.kills + score.treasures + score.secrets - points
+        done = self.game.ticks >= self.max_ticks
+        return self.observe(), reward, done
+
+
+def run_worker(connection, names, start, stop, nb_envs, options):
+    """
+    Main function of a worker process of a `VectorEnvironment`, stepping environments start to stop - 1 when requested
+    :param connection: end of the pipe used to receive commands and to signal that they were executed
+    :param names: names of the shared memory blocks of actions, frames, states, rewards and done flags
+    :param start: index of the first environment of the worker
+    :param stop: index of the last environment of the worker + 1
+    :param nb_envs: total number of environments
+    :param options: keyword arguments used to create the environments
+    """
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    envs = [Environment(**options) for _ in range(start, stop)]
+    # the arrays on the shared buffers are released when the loop returns, before the blocks are closed
+    serve(connection, range(start, stop), envs, *shared_arrays(blocks, nb_envs, options['width'], options['height']))
+    for block in blocks:
+        block.close()
+
+
+def serve(connection, indexes, envs, actions, frames, states, rewards, dones):
+    """
+    Execute the commands received by a worker process until it is closed
+    :param connection: end of the pipe used to receive commands and to signal that they were executed
+    :param indexes: indexes of the environments of the worker
+    :param envs: environments of the worker
+    :param actions: shared array of the actions of all environments
+    :param frames: shared array of the frames of all environments
+    :param states: shared array of the states of all environments
+    :param rewards: shared array of the rewards of all environments
+    :param dones: shared array of the done flags of all environments
+    """
+    def write(i, observation):
+        frame, state = observation
+        if frame is not None:
+            frames[i] = frame
+        states[i] = state
+
+    while True:
+        command = connection.recv()
+        if command == 'reset':
+            for i, env in zip(indexes, envs):
+                write(i, env.reset())
+        elif command == 'step':
+            for i, env in zip(indexes, envs):
+                observation, rewards[i], dones[i] = env.step(int(actions[i]))
+                if dones[i]:
+                    # episodes that are over start again, the first observation of the next episode is returned
+                    observation = env.reset()
+                write(i, observation)
+        else:
+            break
+        connection.send(command)
+
+
+def shared_arrays(blocks, nb_envs, width, height):
+    """
+    Arrays of a `VectorEnvironment` in shared memory blocks
+    :param blocks: shared memory blocks of actions, frames, states, rewards and done flags
+    :param nb_envs: number of environments
+    :param width: width of the frames
+    :param height: height of the frames
+    :return: list of arrays (actions, frames, states, rewards, dones), with one row per environment
+    """
+    shapes = [((nb_envs,), np.int32), ((nb_envs, width, height), np.uint8), ((nb_envs, len(STATE_FIELDS)), np.float64),
+              ((nb_envs,), np.float64), ((nb_envs,), bool)]
+    return [np.ndarray(shape, dtype=dtype, buffer=block.buf) for (shape, dtype), block in zip(shapes, blocks)]
+
+
+class VectorEnvironment:
+    """
+    Many independent environments stepped together by a pool of worker processes. Actions and observations are
+    exchanged through shared memory, and each worker steps a contiguous range of environments when it is signaled.
+    Textures and level data are loaded before the workers are started so that the processes share them.
+    Episodes that are over are automatically reset.
+    """
+    def __init__(self, nb_envs, workers=None, **options):
+        """
+        Initializer
+        :param nb_envs: number of environments
+        :param workers: number of worker processes (defaults to the number of CPUs)
+        :param options: keyword arguments used to create the environments (see `Environment`)
+        """
+        options = {**dict(level=0, width=80, height=50, render=True, frame_skip=1, max_ticks=MAX_TICKS), **options}
+        self.nb_envs = nb_envs
+        workers = max(min(workers or os.cpu_count(), nb_envs), 1)
+        # read-only data shared by the forked workers
+        load_textures()
+        prepared_level(options['level'])
+
+        width, height = options['width'], options['height']
+        sizes = [4 * nb_envs, nb_envs * width * height, 8 * nb_envs * len(STATE_FIELDS), 8 * nb_envs, nb_envs]
+        self.blocks = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+        self.actions, self.frames, self.states, self.rewards, self.dones = shared_arrays(
+            self.blocks, nb_envs, width, height)
+        self.connections = []
+        self.processes = []
+        bounds = np.linspace(0, nb_envs, workers + 1).astype(int).tolist()
+        for start, stop in zip(bounds, bounds[1:]):
+            connection, worker_connection = Pipe()
+            process = Process(target=run_worker, daemon=True, args=(
+                worker_connection, [block.name for block in self.blocks], start, stop, nb_envs, options))
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def send(self, command):
+        """
+        Send a command to all workers and wait until they executed it
+        :param command: 'reset' or 'step'
+        """
+        for connection in self.connections:
+            connection.send(command)
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self):
+        """
+        Start a new episode in all environments
+        :return: a pair (frames, states) of arrays with one row per environment (the arrays are overwritten by the
+        next steps)
+        """
+        self.send('reset')
+        return self.frames, self.states
+
+    def step(self, actions):
+        """
+        Advance all environments
+        :param actions: array of the actions of the player in each environment
+        :return: tuple (frames, states, rewards, dones) of arrays with one row per environment (the arrays are
+        overwritten by the next steps)
+        """
+        self.actions[:] = actions
+        self.send('step')
+        return self.frames, self.states, self.rewards, self.dones
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory
+        """
+        for connection in self.connections:
+            connection.send('close')
+        for process in self.processes:
+            process.join()
+        del self.actions, self.frames, self.states, self.rewards, self.dones
+        for block in self.blocks:
+            block.close()
+            block.unlink()
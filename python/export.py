@@ -0,0 +1,220 @@
+import argparse
+import os
+import struct
+import time
+import zlib
+from functools import lru_cache
+from multiprocessing import Pool
+
+import numpy as np
+from bundle import write_bundle
+from engine import DOOR_TEXTURES
+from game import VSwap, W3DException, ASSET_FILES, BUNDLE, data_digest, decode_sprite, read_level
+from utils import palette_array
+
+# palette index used for transparent pixels of sprites (not used by any opaque pixel in the original sprites)
+TRANSPARENT_COLOR = 255
+# color of floor cells in level images (same as the floor of the renderer)
+FLOOR_COLOR = 25
+# number of tiles on each row of atlases
+ATLAS_COLUMNS = 16
+# size in pixels of a cell in level images
+CELL_SIZE = 8
+# number of level slots in the game files
+NB_LEVELS = 100
+
+
+def png_chunk(tag, data):
+    """
+    Encode a PNG chunk
+    :param tag: 4-byte chunk type
+    :param data: chunk data
+    :return: the encoded chunk (length, type, data and CRC)
+    """
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+
+def write_png(filename, pixels, transparent=None, level=9):
+    """
+    Write an indexed PNG image with the game palette
+    :param filename: path of the file to create
+    :param pixels: 2D array of palette indexes, indexed as pixels[x, y]
+    :param transparent: palette index of transparent pixels (None if the image is opaque)
+    :param level: zlib compression level
+    """
+    width, height = pixels.shape
+    # each row starts with its filter type (0: no filter)
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.T
+    chunks = [
+        png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)),
+        png_chunk(b'PLTE', palette_array.tobytes()),
+    ]
+    if transparent is not None:
+        chunks.append(png_chunk(b'tRNS', b'\xff' * transparent + b'\x00'))
+    chunks.append(png_chunk(b'IDAT', zlib.compress(rows.tobytes(), level)))
+    chunks.append(png_chunk(b'IEND', b''))
+    with open(filename, 'wb') as fp:
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        fp.write(b''.join(chunks))
+
+
+def atlas(tiles, fill=0):
+    """
+    Arrange tiles in a grid of ATLAS_COLUMNS columns
+    :param tiles: array of shape (number of tiles, 64, 64), tiles are indexed as tile[x, y]
+    :param fill: value of the pixels that are not covered by a tile
+    :return: 2D array indexed as [x, y]
+    """
+    nb_rows = -(-len(tiles) // ATLAS_COLUMNS)
+    grid = np.full((nb_rows * ATLAS_COLUMNS, 64, 64), fill, dtype=tiles.dtype)
+    grid[:len(tiles)] = tiles
+    # grid[row, column, x, y] -> image[column, x, row, y]
+    return grid.reshape((nb_rows, ATLAS_COLUMNS, 64, 64)).transpose((1, 2, 0, 3)).reshape(
+        (ATLAS_COLUMNS * 64, nb_rows * 64))
+
+
+def level_image(plane0, walls):
+    """
+    Top view of a level: walls and doors show their texture (downscaled), other cells have the floor color
+    :param plane0: plane0 of the level, indexed as plane0[x, y]
+    :param walls: array of wall textures
+    :return: 2D array of palette indexes, indexed as [x, y]
+    """
+    m0 = plane0.astype(np.intp)
+    texture = np.full(m0.shape, -1)
+    texture[m0 <= 63] = 2 * m0[m0 <= 63] - 2
+    is_door = (m0 >= 90) & (m0 <= 101)
+    texture[is_door] = DOOR_TEXTURES[m0[is_door] - 90]
+    # tiles[t] is texture t downscaled to a cell, the last tile is the floor
+    step = 64 // CELL_SIZE
+    tiles = np.concatenate([walls[:, ::step, ::step], np.full((1, CELL_SIZE, CELL_SIZE), FLOOR_COLOR, np.uint8)])
+    cells = tiles[texture]  # indexed as [x, y, cell x, cell y]
+    return cells.transpose((0, 2, 1, 3)).reshape((m0.shape[0] * CELL_SIZE, m0.shape[1] * CELL_SIZE))
+
+
+@lru_cache(maxsize=1)
+def vswap():
+    """
+    VSWAP file opened once in each process
+    """
+    return VSwap()
+
+
+def export_wall(index, output):
+    """
+    Export a wall texture (executed in a worker process)
+    :param index: index of the wall texture
+    :param output: directory where images are written, or None to only read the texture
+    :return: array of shape (64, 64) of palette indexes
+    """
+    wall = np.array(vswap().wall(index))
+    if output is not None:
+        write_png(os.path.join(output, 'walls', '{:03}.png'.format(index)), wall)
+    return wall
+
+
+def export_sprite(index, output):
+    """
+    Decode and export a sprite (executed in a worker process)
+    :param index: index of the sprite
+    :param output: directory where images are written, or None to only decode the sprite
+    :return: a pair (pixels, mask) of arrays of shape (64, 64) (see `game.decode_sprite`)
+    """
+    pixels, mask = decode_sprite(vswap().sprite_chunk(index))
+    if output is not None:
+        write_png(os.path.join(output, 'sprites', '{:03}.png'.format(index)),
+                  np.where(mask, pixels, TRANSPARENT_COLOR), transparent=TRANSPARENT_COLOR)
+    return pixels, mask
+
+
+def export_level(level, output):
+    """
+    Decode and export a level (executed in a worker process)
+    :param level: index of the level
+    :param output: directory where images are written, or None to only decode the level
+    :return: tuple (name, plane0, plane1) (see `game.read_level`), or None if the level does not exist
+    """
+    try:
+        name, plane0, plane1 = read_level(level)
+    except W3DException:
+        return None
+    if output is not None:
+        write_png(os.path.join(output, 'levels', '{:02}.png'.format(level)), level_image(plane0, vswap().walls()))
+    return name, plane0, plane1
+
+
+def export_atlas(filename, tiles, transparent=None):
+    """
+    Write an atlas of tiles (executed in a worker process)
+    :param filename: path of the image file
+    :param tiles: array of tiles
+    :param transparent: palette index of transparent pixels (None if tiles are opaque)
+    """
+    write_png(filename, atlas(tiles, fill=0 if transparent is None else transparent), transparent=transparent)
+
+
+def export(output=None, bundle=None, workers=None):
+    """
+    Decode all walls, sprites and levels of the game files, in parallel
+    :param output: directory where images and atlases are written (None to write no image)
+    :param bundle: path of the bundle file to create (None to write no bundle)
+    :param workers: number of worker processes (defaults to the number of CPUs)
+    :return: dictionary of decoded arrays (the content of the bundle)
+    """
+    if output is not None:
+        for directory in ('walls', 'sprites', 'levels'):
+            os.makedirs(os.path.join(output, directory), exist_ok=True)
+    with Pool(workers) as pool:
+        walls = pool.starmap_async(export_wall, [(i, output) for i in range(vswap().nb_walls)])
+        sprites = pool.starmap_async(export_sprite, [(i, output) for i in range(vswap().nb_sprites)])
+        levels = pool.starmap_async(export_level, [(level, output) for level in range(NB_LEVELS)])
+        walls = np.stack(walls.get())
+        sprites = sprites.get()
+        sprite_pixels = np.stack([pixels for pixels, mask in sprites])
+        sprite_masks = np.stack([mask for pixels, mask in sprites])
+        if output is not None:
+            atlases = [
+                pool.apply_async(export_atlas, (os.path.join(output, 'walls.png'), walls)),
+                pool.apply_async(export_atlas, (
+                    os.path.join(output, 'sprites.png'), np.where(sprite_masks, sprite_pixels, TRANSPARENT_COLOR),
+                    TRANSPARENT_COLOR)),
+            ]
+            for result in atlases:
+                result.get()
+        levels = levels.get()
+
+    # levels are stored by index, missing levels have an empty name
+    nb_levels = max(level for level, result in enumerate(levels) if result is not None) + 1
+    names = np.zeros(nb_levels, dtype='S20')
+    planes = np.zeros((nb_levels, 2, 64, 64), dtype='<u2')
+    for level, result in enumerate(levels[:nb_levels]):
+        if result is not None:
+            names[level], planes[level, 0], planes[level, 1] = result[0].encode('ascii'), result[1], result[2]
+    arrays = {
+        'digest': np.array([data_digest(ASSET_FILES)], dtype='S40'),
+        'walls': walls,
+        'sprite_pixels': sprite_pixels,
+        'sprite_masks': sprite_masks,
+        'names': names,
+        'planes': planes,
+    }
+    if bundle is not None:
+        write_bundle(bundle, arrays)
+    return arrays
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the walls, sprites and levels of the game files")
+    parser.add_argument('-o', '--output', default='export',
+                        help="directory where PNG images and atlases are written")
+    parser.add_argument('--no-images', action='store_true', help="only write the bundle")
+    parser.add_argument('-b', '--bundle', default=BUNDLE,
+                        help="bundle file loaded by the game instead of the game files")
+    parser.add_argument('--no-bundle', action='store_true', help="only write images")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    export(None if args.no_images else args.output, None if args.no_bundle else args.bundle, args.workers)
+    print("Exported in {:.2f} s".format(time.perf_counter() - start))
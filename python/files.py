@@ -0,0 +1,21 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_open(filename):
+    """
+    Context manager opening a file for writing (in binary mode). The data is written to a temporary file with a unique
+    name that only replaces the file once it is complete, so that an interrupted write cannot leave a corrupt file and
+    processes writing the same file at the same time do not interfere.
+    :param filename: path of the file to create
+    """
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            yield fp
+    except BaseException:
+        os.remove(temporary)
+        raise
+    os.replace(temporary, filename)
@@ -1,9 +1,52 @@
+import copy
+import hashlib
+import mmap
+import os
 import struct
-from math import sin, cos
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
+from math import sin, cos, hypot
+from bundle import Bundle, BundleException
+from files import atomic_open
+from visibility import Visibility
 
 VSWAP = '../data/VSWAP.WL6'
 MAPHEAD = '../data/MAPHEAD.WL6'
 GAMEMAPS = '../data/GAMEMAPS.WL6'
+CACHE_DIR = '../data/cache'
+# bundle of decoded assets written by export.py, and game files from which it is made
+BUNDLE = '../data/cache/assets.bundle'
+ASSET_FILES = (VSWAP, MAPHEAD, GAMEMAPS)
+
+RLEW_TAG = 0xABCD
+# radius of the player and actors (for collision detection)
+RADIUS = .25
+# kinds of cells for the ray caster (`Map.kind`)
+EMPTY = 0
+WALL = 1
+DOOR = 2
+PUSHWALL = 3  # pushwall that is currently moving
+# number of updates for a door to open or close, or for a pushwall to move by one cell
+ANIMATION_STEPS = 64
+# number of game ticks per second (same as the original game)
+TICK_RATE = 70
+# actions of the player during a tick (bit flags, combined in an integer)
+ACTION_FORWARD = 1
+ACTION_BACKWARD = 2
+ACTION_TURN_LEFT = 4
+ACTION_TURN_RIGHT = 8
+ACTION_USE = 16  # activates the cell in front of the player when the action starts
+# directions (dx, dy) of the player for the plane1 values of the starting position (19: north, 20: east, 21: south,
+# 22: west)
+PLAYER_DIRECTIONS = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+# plane0 value of elevator switches, and of the floor in front of secret elevators
+ELEVATOR_TILE = 21
+SECRET_ELEVATOR_TILE = 107
+# floor reached from the secret level of each episode (floors are numbered from 0 in each episode, the secret level
+# is floor 9)
+ELEVATOR_BACK_TO = [1, 1, 7, 3, 5, 3]
 
 
 class W3DException(Exception):
@@ -28,6 +71,70 @@ class Score:
         self.total_secrets = 0
 
 
+def can_move_to(blocking, x, y, radius=RADIUS):
+    """
+    Check whether a circle can be placed at a given position without overlapping a blocking cell. Only the cell
+    containing the center and its 8 neighbours are tested (the radius must be smaller than 1).
+    :param blocking: 2D array of booleans indexed as blocking[x, y], True for cells that block movement
+    :param x: x-coordinate of the center of the circle
+    :param y: y-coordinate of the center of the circle
+    :param radius: radius of the circle
+    :return: whether the position is valid
+    """
+    cx = int(x)
+    cy = int(y)
+    if blocking[cx, cy]:
+        return False
+    fx = x - cx
+    fy = y - cy
+    # distance from the center to the closest point of the neighbouring columns and rows of cells
+    distances_x = ((-1, fx), (1, 1 - fx))
+    distances_y = ((-1, fy), (1, 1 - fy))
+    r2 = radius * radius
+    for i, ddx in distances_x:
+        if ddx < radius and blocking[cx + i, cy]:
+            return False
+    for j, ddy in distances_y:
+        if ddy < radius and blocking[cx, cy + j]:
+            return False
+        for i, ddx in distances_x:
+            if ddx * ddx + ddy * ddy < r2 and blocking[cx + i, cy + j]:
+                return False
+    return True
+
+
+def can_move_to_many(blocking, x, y, radius=RADIUS):
+    """
+    Vectorized version of `can_move_to`, testing many positions at once
+    :param blocking: 2D array of booleans indexed as blocking[x, y], True for cells that block movement
+    :param x: array of x-coordinates of the centers of the circles
+    :param y: array of y-coordinates of the centers of the circles
+    :param radius: radius of the circles
+    :return: array of booleans indicating which positions are valid
+    """
+    cx = x.astype(np.intp)
+    cy = y.astype(np.intp)
+    fx = x - cx
+    fy = y - cy
+    free = ~blocking[cx, cy]
+    r2 = radius * radius
+    for i, ddx in ((-1, fx), (0, 0), (1, 1 - fx)):
+        for j, ddy in ((-1, fy), (0, 0), (1, 1 - fy)):
+            if i != 0 or j != 0:
+                free &= ~((ddx * ddx + ddy * ddy < r2) & blocking[cx + i, cy + j])
+    return free
+
+
+@lru_cache(maxsize=64)
+def rotation(angle):
+    """
+    Cosine and sine of a rotation angle (only a few different angles are used to turn, so they are computed once)
+    :param angle: angle in radians
+    :return: a pair (cos(angle), sin(angle))
+    """
+    return cos(angle), sin(angle)
+
+
 class Player:
     def __init__(self):
         self.x = 0
@@ -37,107 +144,734 @@ class Player:
         self.score = Score()
         self.silver_key = False
         self.gold_key = False
-        self.speed_angle = .05
-        self.speed = .065
+        # turning and walking speeds per tick (about 3 radians and 3.9 cells per second)
+        self.speed_angle = .043
+        self.speed = .056
+        self.radius = RADIUS
+        # position and direction at the start of the last tick, used to interpolate the view between ticks
+        self.previous = (0, 0, 0, 0)
 
     def start_level(self):
         self.score.reset()
         self.silver_key = False
         self.gold_key = False
 
+    @contextmanager
+    def interpolate(self, alpha):
+        """
+        Context manager placing the player between its state at the start of the last tick and its current state
+        (the current state is restored when exiting)
+        :param alpha: interpolation factor (0 for the previous state, 1 for the current state)
+        """
+        current = self.x, self.y, self.dx, self.dy
+        px, py, pdx, pdy = self.previous
+        self.x = px + alpha * (current[0] - px)
+        self.y = py + alpha * (current[1] - py)
+        dx = pdx + alpha * (current[2] - pdx)
+        dy = pdy + alpha * (current[3] - pdy)
+        norm = hypot(dx, dy)
+        if norm > 0:
+            self.dx = dx / norm
+            self.dy = dy / norm
+        try:
+            yield self
+        finally:
+            self.x, self.y, self.dx, self.dy = current
+
     def turn(self, direction):
-        angle = direction * self.speed_angle
-        self.dx, self.dy = self.dx * cos(angle) - self.dy * sin(angle), self.dx * sin(angle) + self.dy * cos(angle)
+        c, s = rotation(direction * self.speed_angle)
+        self.dx, self.dy = self.dx * c - self.dy * s, self.dx * s + self.dy * c
 
-    def move(self, direction):
+    def move(self, direction, blocking=None):
+        """
+        Move forward (or backwards), sliding along walls
+        :param direction: 1 to move forward, -1 to move backwards
+        :param blocking: 2D array of the cells that block movement (no collision detection if None)
+        """
         distance = direction * self.speed
-        self.x += distance * self.dx
-        self.y += distance * self.dy
+        x = self.x + distance * self.dx
+        y = self.y + distance * self.dy
+        if blocking is None:
+            self.x, self.y = x, y
+            return
+        # each axis is tested separately so that the player slides along walls
+        if can_move_to(blocking, x, self.y, self.radius):
+            self.x = x
+        if can_move_to(blocking, self.x, y, self.radius):
+            self.y = y
+
+
+class Thing:
+    """
+    Object placed in the level (decoration, collectible item, etc.), drawn as a sprite
+    """
+    def __init__(self, x, y, sprite_index, collectible=False, blocking=False):
+        """
+        Initializer
+        :param x: x-coordinate of the cell containing the thing
+        :param y: y-coordinate of the cell containing the thing
+        :param sprite_index: index of the sprite representing the thing
+        :param collectible: whether the thing can be collected by the player
+        :param blocking: whether the thing blocks movement
+        """
+        self.x = x + .5
+        self.y = y + .5
+        self.sprite_index = sprite_index
+        self.collectible = collectible
+        self.blocking = blocking
+
+
+class EnemyType:
+    """
+    Characteristics shared by all enemies of a type
+    """
+    def __init__(self, name, stand_sprite, walk_sprite, death_sprites, health, speed, orientable=True):
+        """
+        Initializer
+        :param name: name of the type
+        :param stand_sprite: index of the standing sprite (first of 8 rotations if the enemy is orientable)
+        :param walk_sprite: index of the first walking sprite (4 frames of 8 rotations if the enemy is orientable)
+        :param death_sprites: indexes of the sprites of the dying animation (the last one is the dead body)
+        :param health: initial health points
+        :param speed: distance travelled in a tick when chasing the player
+        :param orientable: whether the enemy has different sprites depending on the direction it is facing
+        """
+        self.name = name
+        self.stand_sprite = stand_sprite
+        self.walk_sprite = walk_sprite
+        self.death_sprites = death_sprites
+        self.health = health
+        self.speed = speed
+        self.orientable = orientable
+
+
+ENEMY_TYPES = [
+    EnemyType('guard', 50, 58, [90, 91, 92, 93, 95], 25, .023),
+    EnemyType('dog', 99, 99, [131, 132, 133, 134], 1, .046),
+    EnemyType('ss', 138, 146, [179, 180, 181, 183], 100, .031),
+    EnemyType('mutant', 187, 195, [228, 229, 230, 232, 233], 55, .023),
+    EnemyType('officer', 238, 246, [279, 280, 281, 283, 284], 50, .039),
+    EnemyType('hans', 300, 300, [304, 305, 306, 303], 850, .023, False),
+    EnemyType('schabbs', 312, 312, [313, 314, 315, 316], 850, .023, False),
+    EnemyType('fake hitler', 321, 321, [328, 329, 330, 331, 332, 333], 200, .023, False),
+    EnemyType('hitler', 349, 349, [353, 354, 355, 356, 357, 358, 359, 352], 800, .023, False),
+    EnemyType('otto', 364, 364, [366, 367, 368, 369], 850, .023, False),
+    EnemyType('gretel', 389, 389, [393, 394, 395, 392], 850, .023, False),
+    EnemyType('fettgesicht', 400, 400, [404, 405, 406, 407], 850, .023, False),
+]
+# enemy types indexed by name
+ENEMY_TYPE_INDEX = {enemy_type.name: i for i, enemy_type in enumerate(ENEMY_TYPES)}
+
+# enemy states
+STAND = 0
+PATROL = 1
+CHASE = 2
+DYING = 3
+DEAD = 4
+# unit vectors of the 8 directions (east, north-east, north, ..., south-east), north is towards negative y
+DIRECTIONS = np.array([(1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1)])
+# distance travelled in a tick by patrolling enemies
+PATROL_SPEED = .0078
+# enemies notice the player if it is in front of them and closer than this distance
+ALERT_DISTANCE = 8
+# chasing enemies stop moving when they are closer than this distance to the player
+ATTACK_DISTANCE = 1.5
+# number of ticks between two frames of the walking and dying animations
+FRAME_TICKS = 8
+
+
+# first plane1 value of the ranges of 8 values where enemies of each type are placed (standing enemies facing
+# east, north, west, south, then patrolling enemies) for the first two difficulty levels
+ENEMY_SPAWN_RANGES = [(108, 'guard'), (144, 'guard'), (116, 'officer'), (152, 'officer'), (126, 'ss'), (162, 'ss'),
+                      (134, 'dog'), (170, 'dog'), (216, 'mutant'), (234, 'mutant')]
+# plane1 values of bosses
+BOSS_SPAWNS = {160: 'fake hitler', 178: 'hitler', 179: 'fettgesicht', 196: 'schabbs', 197: 'gretel', 214: 'hans',
+               215: 'otto'}
+
+
+# kinds of objects placed by plane1 values
+SPAWN_NONE = 0
+SPAWN_PLAYER = 1
+SPAWN_THING = 2
+SPAWN_ENEMY = 3
+SPAWN_SECRET = 4  # pushwall
+# plane1 values of things that can be collected, that block movement and that count as treasures
+COLLECTIBLE_THINGS = [29, 43, 44, 47, 48, 49, 50, 51, 52, 53, 54, 55, 56]
+BLOCKING_THINGS = [24, 25, 26, 28, 30, 31, 33, 34, 35, 36, 38, 39, 40, 41, 45, 58, 59, 60, 62, 63, 67, 68, 69, 71, 73]
+TREASURE_THINGS = [52, 53, 54, 55, 56]
+# fields of the spawn table: kind of object, sprite and flags of things, type, direction and state of enemies (the
+# direction of the player is an index in PLAYER_DIRECTIONS)
+SPAWN_FIELDS = [('kind', np.uint8), ('sprite', np.int16), ('collectible', bool), ('blocking', bool),
+                ('treasure', bool), ('type', np.int8), ('direction', np.int8), ('state', np.int8)]
+
+
+def spawn_table():
+    """
+    Lookup table of the objects placed by plane1 values, used to classify all the cells of a level at once
+    (ghosts, plane1 values 224 to 227, are not placed because they need sprite animations)
+    :return: structured array of 65536 entries (one for each plane1 value) with fields SPAWN_FIELDS
+    """
+    table = np.zeros(1 << 16, dtype=SPAWN_FIELDS)
+    table['type'] = -1
+    # player starting positions (facing north, east, south and west)
+    table['kind'][19: 23] = SPAWN_PLAYER
+    table['direction'][19: 23] = np.arange(4)
+    # things, sprites follow the order of plane1 values
+    things = table[23: 75]
+    things['kind'] = SPAWN_THING
+    things['sprite'] = np.arange(23, 75) - 21
+    table['collectible'][COLLECTIBLE_THINGS] = True
+    table['blocking'][BLOCKING_THINGS] = True
+    table['treasure'][TREASURE_THINGS] = True
+    table['kind'][124] = SPAWN_THING
+    table['sprite'][124] = 95
+    table['kind'][98] = SPAWN_SECRET
+    # enemies: standing enemies facing east, north, west and south, then patrolling enemies (directions are even
+    # indexes in DIRECTIONS)
+    for first, name in ENEMY_SPAWN_RANGES:
+        enemies = table[first: first + 8]
+        enemies['kind'] = SPAWN_ENEMY
+        enemies['type'] = ENEMY_TYPE_INDEX[name]
+        enemies['direction'] = 2 * (np.arange(8) % 4)
+        enemies['state'] = [STAND] * 4 + [PATROL] * 4
+    for m1, name in BOSS_SPAWNS.items():
+        table[m1] = (SPAWN_ENEMY, 0, False, False, False, ENEMY_TYPE_INDEX[name], 6, STAND)
+    return table
+
+
+SPAWN_TABLE = spawn_table()
+
+
+class Enemies:
+    """
+    All the enemies of a level, stored as columns (one array per attribute, one row per enemy) so that they can all
+    be updated at once
+    """
+    # names of the columns
+    COLUMNS = ['x', 'y', 'type', 'direction', 'state', 'timer', 'health', 'target_x', 'target_y', 'distance']
+
+    def __init__(self, x=(), y=(), types=(), directions=(), states=()):
+        """
+        Initializer
+        :param x: x-coordinates of the cells where the enemies are
+        :param y: y-coordinates of the cells where the enemies are
+        :param types: indexes of the enemies types in ENEMY_TYPES
+        :param directions: facing directions (indexes in DIRECTIONS)
+        :param states: initial states (STAND or PATROL)
+        """
+        self.type = np.array(types, dtype=np.intp)
+        self.x = np.array(x, dtype=np.float64) + .5
+        self.y = np.array(y, dtype=np.float64) + .5
+        self.direction = np.array(directions, dtype=np.intp)
+        self.state = np.array(states, dtype=np.int8)
+        self.timer = np.zeros(len(self.type), dtype=np.int32)
+        self.health = np.array([ENEMY_TYPES[t].health for t in self.type.tolist()], dtype=np.int32)
+        # cell towards which a patrolling enemy is walking
+        self.target_x = np.array(x, dtype=np.intp)
+        self.target_y = np.array(y, dtype=np.intp)
+        # distance to the player (computed at each update)
+        self.distance = np.full(len(self.type), np.inf)
+
+        # characteristics of the types, indexed by type
+        self.type_speed = np.array([t.speed for t in ENEMY_TYPES])
+        self.type_stand_sprite = np.array([t.stand_sprite for t in ENEMY_TYPES])
+        self.type_walk_sprite = np.array([t.walk_sprite for t in ENEMY_TYPES])
+        self.type_orientable = np.array([t.orientable for t in ENEMY_TYPES])
+        self.type_nb_death_sprites = np.array([len(t.death_sprites) for t in ENEMY_TYPES])
+        self.type_death_sprites = np.zeros((len(ENEMY_TYPES), self.type_nb_death_sprites.max()), dtype=np.intp)
+        for i, enemy_type in enumerate(ENEMY_TYPES):
+            self.type_death_sprites[i] = enemy_type.death_sprites[-1]
+            self.type_death_sprites[i, :len(enemy_type.death_sprites)] = enemy_type.death_sprites
+
+    def __len__(self):
+        return len(self.type)
+
+    def __getitem__(self, index):
+        return Enemy(self, index)
+
+    def __iter__(self):
+        return (Enemy(self, i) for i in range(len(self)))
+
+    def update(self, player, blocking, plane1, visibility=None):
+        """
+        Advance all enemies by one tick: state transitions, patrol and chase movements, animations
+        :param player: the player
+        :param blocking: 2D array of the cells that block movement
+        :param plane1: plane1 of the level (patrol paths are defined by direction arrows in plane1)
+        :param visibility: visibility index of the level (`visibility.Visibility`), if set enemies only notice the
+        player if they can see it
+        """
+        if len(self) == 0:
+            return
+        self.timer += 1
+        dx = player.x - self.x
+        dy = player.y - self.y
+        np.hypot(dx, dy, out=self.distance)
+
+        # standing or patrolling enemies notice the player when it is close and in front of them
+        facing = DIRECTIONS[self.direction]
+        alert = (self.state <= PATROL) & (self.distance < ALERT_DISTANCE) & (facing[:, 0] * dx + facing[:, 1] * dy > 0)
+        alert = np.flatnonzero(alert)
+        if visibility is not None and alert.size > 0:
+            alert = alert[visibility.can_see(player.x, player.y, self.x[alert], self.y[alert])]
+            px, py = int(player.x), int(player.y)
+            alert = np.array([i for i in alert.tolist() if visibility.line_of_sight(
+                px, py, int(self.x[i]), int(self.y[i]))], dtype=np.intp)
+        self.state[alert] = CHASE
+
+        self.patrol(np.flatnonzero(self.state == PATROL), blocking, plane1)
+        self.chase(np.flatnonzero(self.state == CHASE), dx, dy, blocking)
+
+        # dying enemies become dead bodies at the end of their animation
+        dying = np.flatnonzero(self.state == DYING)
+        finished = dying[self.timer[dying] >= FRAME_TICKS * self.type_nb_death_sprites[self.type[dying]]]
+        self.state[finished] = DEAD
+
+    def patrol(self, p, blocking, plane1):
+        """
+        Move patrolling enemies from cell to cell: on arriving at the center of a cell they follow the direction arrow
+        of the cell (if any) and turn back if the next cell is blocked
+        :param p: indexes of the patrolling enemies
+        :param blocking: 2D array of the cells that block movement
+        :param plane1: plane1 of the level
+        """
+        if p.size == 0:
+            return
+        rx = self.target_x[p] + .5 - self.x[p]
+        ry = self.target_y[p] + .5 - self.y[p]
+        remaining = np.hypot(rx, ry)
+        arrived = remaining <= PATROL_SPEED
+        # enemies that are still walking to the center of their target cell
+        walking = ~arrived
+        w = p[walking]
+        step = PATROL_SPEED / remaining[walking]
+        self.x[w] += step * rx[walking]
+        self.y[w] += step * ry[walking]
+
+        a = p[arrived]
+        self.x[a] = self.target_x[a] + .5
+        self.y[a] = self.target_y[a] + .5
+        # plane1 values 90-97 are direction arrows
+        arrow = plane1[self.target_x[a], self.target_y[a]].astype(np.intp) - 90
+        turn = (arrow >= 0) & (arrow < 8)
+        self.direction[a[turn]] = arrow[turn]
+        for turn_back in (False, True):
+            if turn_back:
+                self.direction[a] = (self.direction[a] + 4) % 8
+            next_x = self.target_x[a] + DIRECTIONS[self.direction[a], 0]
+            next_y = self.target_y[a] + DIRECTIONS[self.direction[a], 1]
+            free = ~blocking[next_x, next_y]
+            self.target_x[a[free]] = next_x[free]
+            self.target_y[a[free]] = next_y[free]
+            a = a[~free]
+        # enemies blocked in both directions stop patrolling
+        self.state[a] = STAND
+
+    def chase(self, c, dx, dy, blocking):
+        """
+        Move chasing enemies towards the player, sliding along walls, until they are close enough to attack
+        :param c: indexes of the chasing enemies
+        :param dx: x-coordinates of the vectors from the enemies to the player
+        :param dy: y-coordinates of the vectors from the enemies to the player
+        :param blocking: 2D array of the cells that block movement
+        """
+        if c.size == 0:
+            return
+        distance = self.distance[c]
+        # facing direction rounded to the closest of the 8 directions (angles are counterclockwise, north is -y)
+        self.direction[c] = np.rint(np.arctan2(-dy[c], dx[c]) / (np.pi / 4)).astype(np.intp) % 8
+        c = c[distance > ATTACK_DISTANCE]
+        step = self.type_speed[self.type[c]] / self.distance[c]
+        x = self.x[c] + step * dx[c]
+        free = can_move_to_many(blocking, x, self.y[c])
+        self.x[c[free]] = x[free]
+        y = self.y[c] + step * dy[c]
+        free = can_move_to_many(blocking, self.x[c], y)
+        self.y[c[free]] = y[free]
+
+    def damage(self, index, amount):
+        """
+        Remove health points from enemies, enemies with no health left start dying
+        :param index: index (or array of indexes) of the enemies
+        :param amount: number of health points to remove
+        :return: array of the indexes of enemies killed by the damage
+        """
+        index = np.atleast_1d(index)
+        index = index[self.state[index] < DYING]
+        self.health[index] -= amount
+        killed = index[self.health[index] <= 0]
+        self.state[killed] = DYING
+        self.timer[killed] = 0
+        return killed
+
+    def sprite_indexes(self, player):
+        """
+        Sprite representing each enemy as seen by the player
+        :param player: the player
+        :return: array of sprite indexes
+        """
+        types = self.type
+        # rotation of the sprite from the angle between the facing direction of the enemy and the player
+        angle = np.arctan2(self.y - player.y, player.x - self.x) / (np.pi / 4) - self.direction
+        rotation = np.where(self.type_orientable[types], np.rint(angle).astype(np.intp) % 8, 0)
+        walk_frame = (self.timer // FRAME_TICKS) % 4
+        sprite = np.where(
+            self.state == STAND,
+            self.type_stand_sprite[types] + rotation,
+            self.type_walk_sprite[types] + np.where(self.type_orientable[types], 8 * walk_frame + rotation, 0))
+        dead = self.state >= DYING
+        death_frame = np.minimum(self.timer // FRAME_TICKS, self.type_nb_death_sprites[types] - 1)
+        sprite[dead] = self.type_death_sprites[types[dead], death_frame[dead]]
+        return sprite
+
+
+class Enemy:
+    """
+    View on a single enemy of an `Enemies` collection: its attributes read and write the columns of the collection
+    """
+    def __init__(self, enemies, index):
+        """
+        Initializer
+        :param enemies: the `Enemies` collection
+        :param index: index of the enemy in the collection
+        """
+        self.enemies = enemies
+        self.index = index
+
+    def __repr__(self):
+        return 'Enemy({}, {}, x={:.2f}, y={:.2f}, state={})'.format(
+            self.index, ENEMY_TYPES[self.type].name, self.x, self.y, self.state)
+
+    @property
+    def alive(self):
+        return self.state < DYING
+
+    def damage(self, amount):
+        """
+        Remove health points from the enemy
+        :param amount: number of health points to remove
+        :return: whether the enemy was killed
+        """
+        return len(self.enemies.damage(self.index, amount)) > 0
+
+
+def column_property(name):
+    """
+    Property of `Enemy` giving access to the enemy's value in a column of the `Enemies` collection
+    :param name: name of the column
+    """
+    def getter(self):
+        return getattr(self.enemies, name)[self.index].item()
+
+    def setter(self, value):
+        getattr(self.enemies, name)[self.index] = value
+    return property(getter, setter)
+
+
+for column in Enemies.COLUMNS:
+    setattr(Enemy, column, column_property(column))
+
+
+class DoorTimer:
+    """
+    Door that is opening or closing
+    """
+    def __init__(self, x, y, opening):
+        self.x = x
+        self.y = y
+        self.opening = opening
+        self.t = 0
+
+
+class WallTimer:
+    """
+    Pushwall that is moving
+    """
+    def __init__(self, x, y, dx, dy, steps=2):
+        """
+        Initializer
+        :param x: x-coordinate of the cell where the wall is
+        :param y: y-coordinate of the cell where the wall is
+        :param dx: x-value of the direction in which the wall moves
+        :param dy: y-value of the direction in which the wall moves
+        :param steps: number of cells the wall moves by (if it is not blocked before)
+        """
+        self.x = x
+        self.y = y
+        self.dx = dx
+        self.dy = dy
+        self.steps = steps
+        self.t = 0
+
+
+def next_level(level, secret=False):
+    """
+    Level reached by the elevator at the end of a level
+    :param level: index of the current level
+    :param secret: whether the secret elevator is used
+    :return: index of the next level
+    """
+    episode, floor = divmod(level, 10)
+    if secret:
+        floor = 9
+    elif floor == 9:
+        floor = ELEVATOR_BACK_TO[episode]
+    else:
+        floor += 1
+    return 10 * episode + floor
+
+
+class Level:
+    """
+    Data of a level prepared before it is played: decoded map, visibility index, things, enemies and starting position
+    of the player. Levels can be prepared in a background thread (see `Game.prefetch`).
+    """
+    def __init__(self, index):
+        """
+        Initializer
+        :param index: index of the level
+        """
+        self.map = Map(index)
+        self.visibility = Visibility(self.map, cache_path('{:02}.areas.npz'.format(index)))
+        # position and direction of the player (x, y, dx, dy)
+        self.start = (0, 0, 0, 0)
+        # objects of all cells, listed row by row (y, then x) as in the game files
+        cells = SPAWN_TABLE[self.map.plane1.T]
+        kind = cells['kind']
+        y, x = np.nonzero(kind == SPAWN_PLAYER)
+        if len(x) > 0:
+            x, y = int(x[-1]), int(y[-1])
+            self.start = (x + .5, y + .5) + PLAYER_DIRECTIONS[cells['direction'][y, x]]
+        # things (blocking things are added to the blocking cells of the map), totals for the score
+        y, x = np.nonzero(kind == SPAWN_THING)
+        things = cells[y, x]
+        self.things = [Thing(*thing) for thing in zip(
+            x.tolist(), y.tolist(), things['sprite'].tolist(), things['collectible'].tolist(),
+            things['blocking'].tolist())]
+        self.map.blocking[x[things['blocking']], y[things['blocking']]] = True
+        self.total_treasures = int(things['treasure'].sum())
+        self.total_secrets = int((kind == SPAWN_SECRET).sum())
+        # enemies as arrays of x, y, type, direction and state (see `Enemies`)
+        y, x = np.nonzero(kind == SPAWN_ENEMY)
+        enemies = cells[y, x]
+        self.spawns = (x, y, enemies['type'], enemies['direction'], enemies['state'])
+
+    def copy(self):
+        """
+        Copy of the level that can be played without modifying this one (only the data that is changed while playing
+        is copied, the rest is shared)
+        :return: a `Level` instance
+        """
+        level = copy.copy(self)
+        level.map = self.map.copy()
+        level.visibility = self.visibility.copy(level.map)
+        return level
+
 
 class Game:
     def __init__(self):
         self.player = Player()
         self.map = None
         self.things = []
+        self.enemies = Enemies()
+        self.visibility = None
         self.door_timers = []
         self.wall_timers = []
+        # number of ticks since the level started and actions of the last tick
+        self.ticks = 0
+        self.actions = 0
+        # levels being prepared in the background (futures of `Level` instances by level index), and whether the next
+        # level is prepared when a level starts
+        self.prefetched = {}
+        self.loader = None
+        self.prefetch_levels = False
 
     def load_level(self, level):
-        self.map = Map(level)
-        self.things.clear()
+        """
+        Start a level (prepared in the background if it was prefetched)
+        :param level: index of the level
+        """
+        prepared = self.prefetched.pop(level, None)
+        self.start_level(prepared.result() if prepared is not None else Level(level))
+
+    def start_level(self, prepared):
+        """
+        Start a prepared level (the level is modified while it is played)
+        :param prepared: a `Level` instance
+        """
+        self.map = prepared.map
+        self.visibility = prepared.visibility
+        self.things[:] = prepared.things
         self.door_timers.clear()
         self.wall_timers.clear()
-        self.player.start_level()
-
-        for y in range(64):
-            for x in range(64):
-                m0, m1 = self.map[x, y]
-                if 19 <= m1 <= 22:
-                    self.player.x = x + .5
-                    self.player.y = y + .5
-                    if m1 == 19:
-                        self.player.dx = 0
-                        self.player.dy = -1
-                    elif m1 == 20:
-                        self.player.dx = 1
-                        self.player.dy = 0
-                    elif m1 == 21:
-                        self.player.dx = 0
-                        self.player.dy = 1
-                    elif m1 == 22:
-                        self.player.dx = -1
-                        self.player.dy = 0
-                # elif 23 <= m1 <= 74:
-                #     is_collectible = m1 in [29, 43, 44, 47, 48, 49, 50, 51, 52, 53, 54, 55, 56]
-                #     if 52 <= m1 <= 56:
-                #         self.score['totalTreasures'] += 1
-                #     self.things.append(Thing(x, y, m1 - 21, is_collectible))
-                #     plane2[x][y] = m1 in [24, 25, 26, 28, 30, 31, 33, 34, 35, 36, 38, 39, 40, 41, 45, 58, 59, 60, 62,
-                #                           63, 67, 68, 69, 71, 73]
-                # elif m1 == 98:
-                #     self.score['totalSecrets'] += 1
-                # elif m1 == 124:
-                #     self.things.append(Thing(x, y, 95))
-                # elif m1 >= 108:
-                #     if 108 <= m1 <= 116:
-                #         self.things.append(GuardEnemy(x, y, (m1 - 108) % 4))
-                #     elif 144 <= m1 < 152:
-                #         self.things.append(GuardEnemy(x, y, (m1 - 144) % 4))
-                #     elif 116 <= m1 < 124:
-                #         self.things.append(OfficerEnemy(x, y, (m1 - 116) % 4))
-                #     elif 152 <= m1 < 160:
-                #         self.things.append(OfficerEnemy(x, y, (m1 - 152) % 4))
-                #     elif 126 <= m1 < 134:
-                #         self.things.append(SSEnemy(x, y, (m1 - 126) % 4))
-                #     elif 162 <= m1 < 170:
-                #         self.things.append(SSEnemy(x, y, (m1 - 162) % 4))
-                #     elif 134 <= m1 < 142:
-                #         self.things.append(DogEnemy(x, y, (m1 - 134) % 4))
-                #     elif 170 <= m1 < 178:
-                #         self.things.append(DogEnemy(x, y, (m1 - 170) % 4))
-                #     elif 216 <= m1 < 224:
-                #         self.things.append(ZombieEnemy(x, y, (m1 - 216) % 4))
-                #     elif 234 <= m1 < 242:
-                #         self.things.append(ZombieEnemy(x, y, (m1 - 234) % 4))
-                #     elif m1 == 160:
-                #         self.things.append(FakeHitlerEnemy(x, y))
-                #     elif m1 == 178:
-                #         self.things.append(HitlerEnemy(x, y))
-                #     elif m1 == 179:
-                #         self.things.append(FettgesightEnemy(x, y))
-                #     elif m1 == 196:
-                #         self.things.append(SchabbsEnemy(x, y))
-                #     elif m1 == 197:
-                #         self.things.append(GetelEnemy(x, y))
-                #     elif m1 == 214:
-                #         self.things.append(HansEnemy(x, y))
-                #     elif m1 == 215:
-                #         self.things.append(OttoEnemy(x, y))
-                #     elif 224 <= m1 < 228:
-                #         ghost = Thing(x, y, 0)
-                #         sprite_index = 288 + 2 * (m1 - 224)
-                #         ghost.start_animation(Animation([sprite_index, sprite_index + 1], True))
-                #         self.things.append(ghost)
+        self.ticks = 0
+        self.actions = 0
+        player = self.player
+        player.start_level()
+        player.x, player.y, player.dx, player.dy = prepared.start
+        player.score.total_treasures = prepared.total_treasures
+        player.score.total_secrets = prepared.total_secrets
+        self.enemies = Enemies(*prepared.spawns)
+        player.score.total_kills = len(self.enemies)
+        player.previous = (player.x, player.y, player.dx, player.dy)
+        if self.prefetch_levels:
+            self.prefetch(next_level(prepared.map.level))
+
+    def prefetch(self, level):
+        """
+        Prepare a level in a background thread so that it can be loaded without waiting
+        :param level: index of the level
+        """
+        if level in self.prefetched:
+            return
+        if self.loader is None:
+            self.loader = ThreadPoolExecutor(max_workers=1)
+        self.prefetched[level] = self.loader.submit(Level, level)
+
+    def activate(self):
+        """
+        Activate the cell in front of the player: open or close a door, push a secret wall or use an elevator switch
+        """
+        player = self.player
+        level_map = self.map
+        x = int(player.x)
+        y = int(player.y)
+        dx = dy = 0
+        if abs(player.dx) >= abs(player.dy):
+            dx = 1 if player.dx >= 0 else -1
+            x += dx
+        else:
+            dy = 1 if player.dy >= 0 else -1
+            y += dy
+        m0, m1 = level_map[x, y]
+        if 90 <= m0 <= 101:
+            if (m0 == 92 or m0 == 93) and not player.gold_key:
+                return
+            if (m0 == 94 or m0 == 95) and not player.silver_key:
+                return
+            if any(timer.x == x and timer.y == y for timer in self.door_timers):
+                return
+            opening = bool(level_map.blocking[x, y])
+            if not opening:
+                if ((dx > 0 and x - player.x <= player.radius) or
+                        (dx < 0 and player.x - x - 1 <= player.radius) or
+                        (dy > 0 and y - player.y <= player.radius) or
+                        (dy < 0 and player.y - y - 1 <= player.radius)):
+                    # the player is too close to the door, it cannot close
+                    return
+                # the door blocks movement as soon as it starts closing
+                level_map.blocking[x, y] = True
+            self.door_timers.append(DoorTimer(x, y, opening))
+        elif m1 == 98 and level_map.kind[x, y] == WALL and self.pushwall_can_enter(x + dx, y + dy):
+            # pushwall that can move backwards
+            level_map.kind[x, y] = PUSHWALL
+            level_map.blocking[x + dx, y + dy] = True
+            level_map.direction[level_map.slot[x, y]] = (dx, dy)
+            # the wall opens a passage between the areas in front of it and behind it
+            areas = self.visibility.areas
+            self.visibility.add_link(areas[x - dx, y - dy], areas[x + dx, y + dy])
+            self.wall_timers.append(WallTimer(x, y, dx, dy))
+            self.player.score.secrets += 1
+        elif m0 == ELEVATOR_TILE and dx != 0:
+            # elevator switches are on east and west walls, the level is completed (with the secret elevator if the
+            # player stands on its floor)
+            secret = level_map.plane0[int(player.x), int(player.y)] == SECRET_ELEVATOR_TILE
+            self.load_level(next_level(level_map.level, secret))
+
+    def pushwall_can_enter(self, x, y):
+        """
+        Test if a pushwall can move into a cell: an empty floor cell (not a door, even open) with no blocking thing,
+        player or living enemy in it
+        :param x: x-coordinate of the cell
+        :param y: y-coordinate of the cell
+        :return: whether the cell is free
+        """
+        level_map = self.map
+        if level_map.plane0[x, y] < 106 or level_map.kind[x, y] != EMPTY or level_map.blocking[x, y]:
+            return False
+        if int(self.player.x) == x and int(self.player.y) == y:
+            return False
+        enemies = self.enemies
+        return not np.any((enemies.x.astype(np.intp) == x) & (enemies.y.astype(np.intp) == y) &
+                          (enemies.state < DYING))
+
+    def tick(self, actions=0):
+        """
+        Advance the game by one tick (1 / TICK_RATE seconds)
+        :param actions: actions of the player during the tick (combination of ACTION_* flags)
+        """
+        player = self.player
+        player.previous = (player.x, player.y, player.dx, player.dy)
+        if actions & ACTION_FORWARD:
+            player.move(1, self.map.blocking)
+        elif actions & ACTION_BACKWARD:
+            player.move(-1, self.map.blocking)
+        if actions & ACTION_TURN_RIGHT:
+            player.turn(1)
+        elif actions & ACTION_TURN_LEFT:
+            player.turn(-1)
+        if actions & ACTION_USE and not self.actions & ACTION_USE:
+            self.activate()
+        self.actions = actions
+        self.update()
+        self.ticks += 1
+
+    def run(self, ticks, policy=None):
+        """
+        Run the simulation for a number of ticks as fast as possible (nothing is rendered)
+        :param ticks: number of ticks
+        :param policy: function called before each tick with the game as argument, returning the actions of the
+        player for the tick (the player does nothing if None)
+        """
+        for _ in range(ticks):
+            self.tick(policy(self) if policy is not None else 0)
+
+    def update(self):
+        """
+        Advance the game by one step: enemies, and animations of doors and pushwalls (only active timers are updated)
+        """
+        level_map = self.map
+        self.enemies.update(self.player, level_map.blocking, level_map.plane1, self.visibility)
+        for timer in self.door_timers:
+            timer.t += 1
+            slot = level_map.slot[timer.x, timer.y]
+            fraction = timer.t / ANIMATION_STEPS
+            level_map.offset[slot] = fraction if timer.opening else 1 - fraction
+            if timer.t >= ANIMATION_STEPS and timer.opening:
+                level_map.blocking[timer.x, timer.y] = False
+        self.door_timers[:] = [timer for timer in self.door_timers if timer.t < ANIMATION_STEPS]
+        self.visibility.update()
+
+        for timer in self.wall_timers:
+            timer.t += 1
+            x, y, dx, dy = timer.x, timer.y, timer.dx, timer.dy
+            slot = level_map.slot[x, y]
+            level_map.offset[slot] = timer.t / ANIMATION_STEPS
+            if timer.t < ANIMATION_STEPS:
+                continue
+            # the wall moves to the next cell, its previous cell gets the floor code of the cell behind it
+            level_map.plane0[x + dx, y + dy] = level_map.plane0[x, y]
+            level_map.plane0[x, y] = level_map.plane0[x - dx, y - dy]
+            level_map.plane1[x, y] = 0
+            self.visibility.set_cell(x, y)
+            self.visibility.set_cell(x + dx, y + dy)
+            level_map.kind[x, y] = EMPTY
+            level_map.blocking[x, y] = False
+            level_map.slot[x + dx, y + dy] = slot
+            level_map.slot[x, y] = -1
+            level_map.offset[slot] = 0
+            timer.steps -= 1
+            if timer.steps > 0 and self.pushwall_can_enter(x + 2 * dx, y + 2 * dy):
+                # the wall moves by one more cell
+                level_map.plane1[x + dx, y + dy] = 98
+                level_map.kind[x + dx, y + dy] = PUSHWALL
+                level_map.blocking[x + 2 * dx, y + 2 * dy] = True
+                timer.x += dx
+                timer.y += dy
+                timer.t = 0
+            else:
+                level_map.kind[x + dx, y + dy] = WALL
+        self.wall_timers[:] = [timer for timer in self.wall_timers if timer.t < ANIMATION_STEPS]
 
 
 def rlew_decode(data):
@@ -147,22 +881,44 @@ def rlew_decode(data):
     :return: a byte string of decoded data
     """
     size = struct.unpack("<H", data[0:2])[0]
-    offset = 2
-    output = bytearray()
-    while offset < len(data):
-        w = data[offset: offset + 2]
-        offset += 2
-        if w == b'\xcd\xab':
-            n = struct.unpack('<H', data[offset: offset + 2])[0]
-            output += n * data[offset + 2: offset + 4]
-            offset += 4
-        else:
-            output += w
+    words = np.frombuffer(data, dtype='<u2', count=(len(data) - 2) // 2, offset=2)
+    tags = np.flatnonzero(words == RLEW_TAG)
+    if (np.diff(tags) <= 2).any():
+        # the tag value appears as the count or value of a run, ignore it there
+        valid_tags = []
+        end = 0
+        for tag in tags.tolist():
+            if tag >= end:
+                valid_tags.append(tag)
+                end = tag + 3
+        tags = np.array(valid_tags, dtype=np.intp)
+    # each tag is followed by a count n and a value: the value is repeated n times, the tag and count are dropped
+    counts = np.ones(len(words), dtype=np.intp)
+    counts[tags] = 0
+    counts[tags + 1] = 0
+    counts[tags + 2] = words[tags + 1]
+    output = bytearray(np.repeat(words, counts).astype('<u2').tobytes())
     if len(output) != size:
         raise W3DException("RLEW decode: Output size mismatch")
     return output
 
 
+def copy_words(output, start, n):
+    """
+    Append a copy of n words of the output to itself, starting at a given byte offset.
+    If the copied range overlaps the end of the output, the words being copied are repeated (as in LZ77 decoding).
+    :param output: bytearray to extend
+    :param start: offset in bytes of the first word to copy
+    :param n: number of words to copy
+    """
+    length = 2 * n
+    while length > 0:
+        chunk = output[start: start + length]
+        output += chunk
+        start += len(chunk)
+        length -= len(chunk)
+
+
 def carmack_decode(data):
     """
     Decode a byte string containing Carmack-encoded data
@@ -173,33 +929,248 @@ def carmack_decode(data):
     offset = 2
     output = bytearray()
     while offset < len(data):
-        if data[offset + 1] == 0xA7 or data[offset + 1] == 0xA8:
+        flag = data[offset + 1]
+        if flag == 0xA7 or flag == 0xA8:
             n = data[offset]
             if n == 0:
                 # exception (not really a pointer)
-                output += data[offset + 2]
-                output += data[offset + 1]
+                output.append(data[offset + 2])
+                output.append(flag)
                 offset += 3
-            elif data[offset + 1] == 0xA7:
+                continue
+            if flag == 0xA7:
                 # near pointer
-                off = -2 * data[offset + 2]
-                for i in range(n):
-                    output += output[off: off + 2]
+                start = len(output) - 2 * data[offset + 2]
                 offset += 3
-            elif data[offset + 1] == 0xA8:
+            else:
                 # far pointer
-                off = 2 * struct.unpack('<H', data[offset + 2: offset + 4])[0]
-                for i in range(n):
-                    output += output[off + 2*i: off + 2*i + 2]
+                start = 2 * (data[offset + 2] | data[offset + 3] << 8)
                 offset += 4
+            if start + 2 * n <= len(output):
+                output += output[start: start + 2 * n]
+            else:
+                copy_words(output, start, n)
         else:
-            output += data[offset: offset+2]
+            output += data[offset: offset + 2]
             offset += 2
     if len(output) != size:
         raise W3DException("Carmack decode: Output size mismatch")
     return output
 
 
+@lru_cache(maxsize=None)
+def data_digest(filenames=(MAPHEAD, GAMEMAPS)):
+    """
+    Hash of game files, used to invalidate cached data when they change
+    :param filenames: paths of the files (the level data files MAPHEAD.WL6 and GAMEMAPS.WL6 by default)
+    :return: a hexadecimal digest string
+    """
+    h = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, "rb") as fp:
+            h.update(fp.read())
+    return h.hexdigest()
+
+
+def cache_path(filename):
+    """
+    Path of a file in the cache directory for the current level data
+    :param filename: name of the cached file
+    :return: path of the file (the directory is created if needed)
+    """
+    directory = os.path.join(CACHE_DIR, data_digest())
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def read_level(level):
+    """
+    Read and decode the planes of a level from the game files (decoded planes are saved in the cache directory)
+    :param level: index of the level
+    :return: tuple (name, plane0, plane1) where planes are arrays of shape (64, 64) indexed as plane[x, y]
+    """
+    with open(MAPHEAD, "rb") as fp:
+        fp.seek(2 + 4 * level)
+        offset = struct.unpack("<I", fp.read(4))[0]
+    if offset == 0:
+        raise W3DException("Invalid level ID.")
+    with open(GAMEMAPS, "rb") as fp:
+        fp.seek(offset)
+        header = struct.unpack("<3I5H20s", fp.read(42))
+        name = header[8]
+        name = name[:name.index(0)].decode('ascii')
+        plane_size = 2 * 64 * 64
+        cache_file = cache_path('{:02}.planes'.format(level))
+        if os.path.exists(cache_file):
+            # decoded planes were saved by a previous run
+            with open(cache_file, "rb") as fp_cache:
+                data = bytearray(fp_cache.read())
+            data0, data1 = data[:plane_size], data[plane_size:]
+        else:
+            fp.seek(header[0])
+            data0 = rlew_decode(carmack_decode(fp.read(header[3])))
+            fp.seek(header[1])
+            data1 = rlew_decode(carmack_decode(fp.read(header[4])))
+            with atomic_open(cache_file) as fp_cache:
+                fp_cache.write(data0)
+                fp_cache.write(data1)
+    # planes are stored row by row, transposed views are indexed as plane[x, y]
+    plane0 = np.frombuffer(data0, dtype='<u2').reshape((64, 64)).T
+    plane1 = np.frombuffer(data1, dtype='<u2').reshape((64, 64)).T
+    return name, plane0, plane1
+
+
+@lru_cache(maxsize=1)
+def load_bundle(filename=BUNDLE):
+    """
+    Asset bundle written by the exporter (see export.py), used instead of the game files if it was made from the
+    current game files
+    :param filename: path of the bundle file
+    :return: a `bundle.Bundle` instance, or None if there is no valid bundle
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        bundle = Bundle(filename)
+    except BundleException:
+        return None
+    if 'digest' not in bundle or bundle['digest'][0].decode('ascii') != data_digest(ASSET_FILES):
+        return None
+    return bundle
+
+
+def decode_sprite(chunk):
+    """
+    Decode a sprite chunk from VSWAP.WL6
+    Sprites are stored as a list of columns, each column being a list of "posts" (vertical segments of opaque
+    pixels). Pixel values of all posts are stored in a common pool, in the order in which posts are listed.
+    :param chunk: bytes-like object containing the chunk data
+    :return: a pair (pixels, mask) of arrays of shape (64, 64) indexed as [x, y]: pixels contains the palette index of
+    each pixel and mask indicates which pixels are opaque
+    """
+    # read chunk header
+    first_column, last_column = struct.unpack_from('<HH', chunk, 0)
+    nb_columns = last_column - first_column + 1
+    first_post_offset = struct.unpack_from('<{}H'.format(nb_columns), chunk, 4)
+    pixel_pool_offset = 4 + 2 * nb_columns
+
+    # list all posts (flat index of their first pixel and length)
+    post_start = []
+    post_length = []
+    for column, offset in enumerate(first_post_offset, first_column):
+        while True:
+            ending_row = struct.unpack_from('<H', chunk, offset)[0]
+            if ending_row == 0:
+                break
+            pool_index, starting_row = struct.unpack_from('<HH', chunk, offset + 2)
+            post_start.append(64 * column + starting_row // 2)
+            post_length.append((ending_row - starting_row) // 2)
+            offset += 6
+
+    # pixels of consecutive posts are consecutive in the pool, so all posts are copied with a single assignment
+    post_length = np.array(post_length, dtype=np.intp)
+    nb_pixels = int(post_length.sum())
+    post_shift = np.array(post_start, dtype=np.intp) - (np.cumsum(post_length) - post_length)
+    indexes = np.repeat(post_shift, post_length) + np.arange(nb_pixels)
+
+    pixels = np.zeros(64 * 64, dtype=np.uint8)
+    mask = np.zeros(64 * 64, dtype=bool)
+    pixels[indexes] = np.frombuffer(chunk, dtype=np.uint8, count=nb_pixels, offset=pixel_pool_offset)
+    mask[indexes] = True
+    return pixels.reshape((64, 64)), mask.reshape((64, 64))
+
+
+class VSwap:
+    """
+    Access to the chunks (wall textures, sprites and sounds) of the VSWAP.WL6 file.
+    The file is memory-mapped and its chunk tables are read once, chunks are then returned as views on the file data.
+    """
+    def __init__(self, filename=VSWAP):
+        """
+        Initializer
+        :param filename: path of the VSWAP file
+        """
+        with open(filename, "rb") as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.data)
+        self.nb_chunks, self.first_sprite, self.first_sound = struct.unpack_from('<3H', self.data, 0)
+        self.chunk_offset = struct.unpack_from('<{}I'.format(self.nb_chunks), self.data, 6)
+        self.chunk_length = struct.unpack_from('<{}H'.format(self.nb_chunks), self.data, 6 + 4 * self.nb_chunks)
+        self.nb_walls = self.first_sprite
+        self.nb_sprites = self.first_sound - self.first_sprite
+        self.nb_sounds = self.nb_chunks - self.first_sound
+        # decoded sprites are kept in memory for later use
+        self.sprite = lru_cache(maxsize=1024)(self.decode_sprite)
+        # all sprites (see `sprites`)
+        self.sprites_pixels = None
+        self.sprites_masks = None
+
+    def chunk(self, index):
+        """
+        Data of a chunk
+        :param index: index of the chunk in the file
+        :return: a memoryview of the chunk data
+        """
+        offset = self.chunk_offset[index]
+        return self.view[offset: offset + self.chunk_length[index]]
+
+    def wall(self, index):
+        """
+        Wall texture
+        :param index: index of the wall texture
+        :return: a read-only array of shape (64, 64) of palette indexes, indexed as [x, y]
+        """
+        return np.frombuffer(self.chunk(index), dtype=np.uint8).reshape((64, 64))
+
+    def walls(self):
+        """
+        All wall textures in a single array
+        :return: an array of shape (nb_walls, 64, 64) of palette indexes (a view on the file data if the wall chunks
+        are stored contiguously, which is the case in the original game files)
+        """
+        offset = self.chunk_offset[0]
+        if self.chunk_offset[:self.nb_walls] == tuple(range(offset, offset + 4096 * self.nb_walls, 4096)):
+            return np.frombuffer(self.view, dtype=np.uint8, count=4096 * self.nb_walls, offset=offset).reshape(
+                (self.nb_walls, 64, 64))
+        return np.stack([self.wall(i) for i in range(self.nb_walls)])
+
+    def sprite_chunk(self, index):
+        """
+        Raw data of a sprite
+        :param index: index of the sprite
+        :return: a memoryview of the chunk data
+        """
+        return self.chunk(self.first_sprite + index)
+
+    def decode_sprite(self, index):
+        """
+        Decode a sprite (use `sprite` instead, which caches the result)
+        :param index: index of the sprite
+        :return: a pair (pixels, mask) of arrays of shape (64, 64) (see `decode_sprite`)
+        """
+        return decode_sprite(self.sprite_chunk(index))
+
+    def sprites(self):
+        """
+        All sprites, decoded once and kept in memory
+        :return: a pair of arrays (pixels, masks) of shape (nb_sprites, 64, 64) (see `decode_sprite`)
+        """
+        if self.sprites_pixels is None:
+            self.sprites_pixels = np.empty((self.nb_sprites, 64, 64), dtype=np.uint8)
+            self.sprites_masks = np.empty((self.nb_sprites, 64, 64), dtype=bool)
+            for i in range(self.nb_sprites):
+                self.sprites_pixels[i], self.sprites_masks[i] = self.sprite(i)
+        return self.sprites_pixels, self.sprites_masks
+
+    def sound_chunk(self, index):
+        """
+        Raw data of a digitized sound
+        :param index: index of the sound chunk
+        :return: a memoryview of the chunk data
+        """
+        return self.chunk(self.first_sound + index)
+
+
 class Map:
     """
     Representation of a Wolfenstein 3D level data
@@ -212,23 +1183,43 @@ class Map:
         if level < 0 or level >= 100:
             raise W3DException("Invalid level ID.")
 
-        with open(MAPHEAD, "rb") as fp:
-            fp.seek(2 + 4 * level)
-            offset = struct.unpack("<I", fp.read(4))[0]
-        if offset == 0:
-            raise W3DException("Invalid level ID.")
-        with open(GAMEMAPS, "rb") as fp:
-            fp.seek(offset)
-            header = struct.unpack("<3I5H20s", fp.read(42))
-            name = header[8]
-            self.name = name[:name.index(0)].decode('ascii')
-            self.level = level
-            fp.seek(header[0])
-            self.plane0 = rlew_decode(carmack_decode(fp.read(header[3])))
-            fp.seek(header[1])
-            self.plane1 = rlew_decode(carmack_decode(fp.read(header[4])))
-            self.width = 64
-            self.height = 64
+        self.level = level
+        self.width = 64
+        self.height = 64
+        bundle = load_bundle()
+        if bundle is not None and level < len(bundle['names']) and bundle['names'][level]:
+            # level decoded by the asset exporter, the planes are copied because pushwalls modify them
+            self.name = bundle['names'][level].decode('ascii')
+            self.plane0 = bundle['planes'][level, 0].copy()
+            self.plane1 = bundle['planes'][level, 1].copy()
+        else:
+            self.name, self.plane0, self.plane1 = read_level(level)
+        # kind of each cell for the ray caster (plane0 values 0-63 are walls and 90-101 are doors)
+        is_door = (self.plane0 >= 90) & (self.plane0 <= 101)
+        self.kind = np.full((self.width, self.height), EMPTY, dtype=np.uint8)
+        self.kind[self.plane0 <= 63] = WALL
+        self.kind[is_door] = DOOR
+        # cells that block movement: walls and closed doors, blocking things are added by the game
+        self.blocking = self.kind != EMPTY
+
+        # doors and pushwalls (plane1 value 98) have a slot in the arrays of animated cells
+        animated = np.argwhere(is_door | ((self.plane1 == 98) & (self.kind == WALL)))
+        self.slot = np.full((self.width, self.height), -1, dtype=np.int16)
+        self.slot[animated[:, 0], animated[:, 1]] = np.arange(len(animated))
+        # state of the animated cells: opening fraction of doors or offset of moving pushwalls (in [0, 1]), and
+        # direction in which pushwalls move
+        self.offset = np.zeros(len(animated))
+        self.direction = np.zeros((len(animated), 2), dtype=np.int8)
+
+    def copy(self):
+        """
+        Copy of the level with its own arrays of the data changed by doors and pushwalls
+        :return: a `Map` instance
+        """
+        level_map = copy.copy(self)
+        for name in ('plane0', 'plane1', 'kind', 'blocking', 'slot', 'offset', 'direction'):
+            setattr(level_map, name, getattr(self, name).copy())
+        return level_map
 
     def __getitem__(self, item):
         """
@@ -236,11 +1227,7 @@ class Map:
         :param item: a pair x, y of coordinates
         :return: a pair of values corresponding to plane0 and plane1 data at given coordinate
         """
-        x, y = item
-        offset = (x + self.width * y) << 1
-        p0 = struct.unpack('<H', self.plane0[offset: offset + 2])[0]
-        p1 = struct.unpack('<H', self.plane1[offset: offset + 2])[0]
-        return p0, p1
+        return int(self.plane0[item]), int(self.plane1[item])
 
     def export(self, filename=None, single_byte=True):
         """
@@ -254,18 +1241,23 @@ class Map:
             filename = '{}.map'.format(self.name.replace(' ', ''))
         with open(filename, 'wb') as fp:
             if single_byte:
-                fp.write(bytes([self.plane0[i] for i in range(0, len(self.plane0), 2)]))
-                fp.write(bytes([self.plane1[i] for i in range(0, len(self.plane1), 2)]))
+                fp.write(self.plane0.T.astype(np.uint8).tobytes())
+                fp.write(self.plane1.T.astype(np.uint8).tobytes())
             else:
-                fp.write(self.plane0)
-                fp.write(self.plane1)
+                fp.write(self.plane0.T.tobytes())
+                fp.write(self.plane1.T.tobytes())
         fp.close()
 
     def find_cell(self, values0=None, values1=None):
-        cells = []
-        for x in range(self.width):
-            for y in range(self.height):
-                v0, v1 = self[x, y]
-                if (values0 is None or v0 in values0) and (values1 is None or v1 in values1):
-                    cells.append((x, y))
-        return cells
+        """
+        Find all cells matching the given plane values
+        :param values0: collection of accepted plane0 values (any value is accepted if None)
+        :param values1: collection of accepted plane1 values (any value is accepted if None)
+        :return: list of (x, y) coordinates of matching cells (sorted by x, then y)
+        """
+        mask = np.ones((self.width, self.height), dtype=bool)
+        if values0 is not None:
+            mask &= np.isin(self.plane0, list(values0))
+        if values1 is not None:
+            mask &= np.isin(self.plane1, list(values1))
+        return [(int(x), int(y)) for x, y in np.argwhere(mask)]
@@ -1,103 +1,129 @@
+import argparse
+import time
 import pygame
-import numpy as np
-from game import Game
-from engine import cast_ray
+from game import Game, TICK_RATE, ACTION_FORWARD, ACTION_BACKWARD, ACTION_TURN_LEFT, ACTION_TURN_RIGHT, ACTION_USE
+from demo import Demo, load_demo, replay, print_header, print_report
+from profiler import Profiler, NULL_PROFILER
+from renderer import Renderer, RENDER_MODES
 
+# duration of a game tick in seconds
+TICK_DURATION = 1 / TICK_RATE
+# longest duration simulated between two frames (the game slows down instead of freezing if frames take longer)
+MAX_FRAME_DURATION = .25
 
-# Wolfenstein 3D color palette (hard-coded in executable)
-palette = [(0, 0, 0), (0, 0, 168), (0, 168, 0), (0, 168, 168), (168, 0, 0), (168, 0, 168), (168, 84, 0),
-           (168, 168, 168), (84, 84, 84), (84, 84, 252), (84, 252, 84), (84, 252, 252), (252, 84, 84), (252, 84, 252),
-           (252, 252, 84), (252, 252, 252), (236, 236, 236), (220, 220, 220), (208, 208, 208), (192, 192, 192),
-           (180, 180, 180), (168, 168, 168), (152, 152, 152), (140, 140, 140), (124, 124, 124), (112, 112, 112),
-           (100, 100, 100), (84, 84, 84), (72, 72, 72), (56, 56, 56), (44, 44, 44), (32, 32, 32), (252, 0, 0),
-           (236, 0, 0), (224, 0, 0), (212, 0, 0), (200, 0, 0), (188, 0, 0), (176, 0, 0), (164, 0, 0), (152, 0, 0),
-           (136, 0, 0), (124, 0, 0), (112, 0, 0), (100, 0, 0), (88, 0, 0), (76, 0, 0), (64, 0, 0), (252, 216, 216),
-           (252, 184, 184), (252, 156, 156), (252, 124, 124), (252, 92, 92), (252, 64, 64), (252, 32, 32), (252, 0, 0),
-           (252, 168, 92), (252, 152, 64), (252, 136, 32), (252, 120, 0), (228, 108, 0), (204, 96, 0), (180, 84, 0),
-           (156, 76, 0), (252, 252, 216), (252, 252, 184), (252, 252, 156), (252, 252, 124), (252, 248, 92),
-           (252, 244, 64), (252, 244, 32), (252, 244, 0), (228, 216, 0), (204, 196, 0), (180, 172, 0), (156, 156, 0),
-           (132, 132, 0), (112, 108, 0), (88, 84, 0), (64, 64, 0), (208, 252, 92), (196, 252, 64), (180, 252, 32),
-           (160, 252, 0), (144, 228, 0), (128, 204, 0), (116, 180, 0), (96, 156, 0), (216, 252, 216), (188, 252, 184),
-           (156, 252, 156), (128, 252, 124), (96, 252, 92), (64, 252, 64), (32, 252, 32), (0, 252, 0), (0, 252, 0),
-           (0, 236, 0), (0, 224, 0), (0, 212, 0), (4, 200, 0), (4, 188, 0), (4, 176, 0), (4, 164, 0), (4, 152, 0),
-           (4, 136, 0), (4, 124, 0), (4, 112, 0), (4, 100, 0), (4, 88, 0), (4, 76, 0), (4, 64, 0), (216, 252, 252),
-           (184, 252, 252), (156, 252, 252), (124, 252, 248), (92, 252, 252), (64, 252, 252), (32, 252, 252),
-           (0, 252, 252), (0, 228, 228), (0, 204, 204), (0, 180, 180), (0, 156, 156), (0, 132, 132), (0, 112, 112),
-           (0, 88, 88), (0, 64, 64), (92, 188, 252), (64, 176, 252), (32, 168, 252), (0, 156, 252), (0, 140, 228),
-           (0, 124, 204), (0, 108, 180), (0, 92, 156), (216, 216, 252), (184, 188, 252), (156, 156, 252),
-           (124, 128, 252), (92, 96, 252), (64, 64, 252), (32, 36, 252), (0, 4, 252), (0, 0, 252), (0, 0, 236),
-           (0, 0, 224), (0, 0, 212), (0, 0, 200), (0, 0, 188), (0, 0, 176), (0, 0, 164), (0, 0, 152), (0, 0, 136),
-           (0, 0, 124), (0, 0, 112), (0, 0, 100), (0, 0, 88), (0, 0, 76), (0, 0, 64), (40, 40, 40), (252, 224, 52),
-           (252, 212, 36), (252, 204, 24), (252, 192, 8), (252, 180, 0), (180, 32, 252), (168, 0, 252), (152, 0, 228),
-           (128, 0, 204), (116, 0, 180), (96, 0, 156), (80, 0, 132), (68, 0, 112), (52, 0, 88), (40, 0, 64),
-           (252, 216, 252), (252, 184, 252), (252, 156, 252), (252, 124, 252), (252, 92, 252), (252, 64, 252),
-           (252, 32, 252), (252, 0, 252), (224, 0, 228), (200, 0, 204), (180, 0, 180), (156, 0, 156), (132, 0, 132),
-           (108, 0, 112), (88, 0, 88), (64, 0, 64), (252, 232, 220), (252, 224, 208), (252, 216, 196), (252, 212, 188),
-           (252, 204, 176), (252, 196, 164), (252, 188, 156), (252, 184, 144), (252, 176, 128), (252, 164, 112),
-           (252, 156, 96), (240, 148, 92), (232, 140, 88), (220, 136, 84), (208, 128, 80), (200, 124, 76),
-           (188, 120, 72), (180, 112, 68), (168, 104, 64), (160, 100, 60), (156, 96, 56), (144, 92, 52), (136, 88, 48),
-           (128, 80, 44), (116, 76, 40), (108, 72, 36), (92, 64, 32), (84, 60, 28), (72, 56, 24), (64, 48, 24),
-           (56, 44, 20), (40, 32, 12), (96, 0, 100), (0, 100, 100), (0, 96, 96), (0, 0, 28), (0, 0, 44), (48, 36, 16),
-           (72, 0, 72), (80, 0, 80), (0, 0, 52), (28, 28, 28), (76, 76, 76), (92, 92, 92), (64, 64, 64), (48, 48, 48),
-           (52, 52, 52), (216, 244, 244), (184, 232, 232), (156, 220, 220), (116, 200, 200), (72, 192, 192),
-           (32, 180, 180), (32, 176, 176), (0, 164, 164), (0, 152, 152), (0, 140, 140), (0, 132, 132), (0, 124, 124),
-           (0, 120, 120), (0, 116, 116), (0, 112, 112), (0, 108, 108), (152, 0, 136)]
 
+def keyboard_actions(pressed_keys):
+    """
+    Actions of the player from the state of the keyboard
+    :param pressed_keys: state of the keys (as returned by pygame.key.get_pressed)
+    :return: combination of ACTION_* flags
+    """
+    actions = 0
+    if pressed_keys[pygame.K_UP]:
+        actions |= ACTION_FORWARD
+    if pressed_keys[pygame.K_DOWN]:
+        actions |= ACTION_BACKWARD
+    if pressed_keys[pygame.K_LEFT]:
+        actions |= ACTION_TURN_LEFT
+    if pressed_keys[pygame.K_RIGHT]:
+        actions |= ACTION_TURN_RIGHT
+    if pressed_keys[pygame.K_SPACE]:
+        actions |= ACTION_USE
+    return actions
 
-def draw_walls(screen):
-    pixel_width = screen.get_width()
-    pixel_height = screen.get_height()
-    fov = 1
-    wall_height = pixel_width / (2 * fov)
 
-    screen_buffer = np.zeros((pixel_width, pixel_height, 3), dtype=np.uint8)
-
-    for col in range(pixel_width):
-        shift = (fov * (2 * col) - pixel_width) / pixel_width
-        rdx = player.dx - shift * player.dy
-        rdy = player.dy + shift * player.dx
-        # sx = player.x + rdx
-        # sy = player.y + rdy
-        rx, ry, t, texture_index, tx = cast_ray(game.map, player.x, player.y, rdx, rdy)
-
-        h = wall_height / (2 * t)  # height of the line representing the wall on the current column
-        # z_index[i] = t
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', action='store_true', help="display the duration of each stage of the game loop")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="number of processes rendering strips of the screen in parallel")
+    parser.add_argument('--trace', metavar='FILE', help="save the durations of all stages to a trace file")
+    parser.add_argument('--fps', type=int, default=60, help="maximum number of frames per second (0 for no limit)")
+    parser.add_argument('--mode', choices=RENDER_MODES, default='flat', help="way of drawing the ceiling and the floor")
+    parser.add_argument('--level', type=int, default=0, help="index of the first level")
+    parser.add_argument('--simulate', type=int, metavar='TICKS',
+                        help="run the given number of ticks as fast as possible without rendering, then exit")
+    parser.add_argument('--record', metavar='FILE', help="record the actions of the player to a demo file")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="replay a demo file as fast as possible, then print the distribution of frame times")
+    args = parser.parse_args()
 
-        yi_min = max(int(pixel_height / 2 - h), 0)
-        yi_max = min(int(pixel_height / 2 + h), pixel_height - 1)
-        screen_buffer[col, :yi_min] = 128
-        screen_buffer[col, yi_max : pixel_height] = 128
-        screen_buffer[col, yi_min: yi_max] = 255
-    pygame.surfarray.blit_array(screen, screen_buffer)
+    game = Game()
+    player = game.player
 
+    if args.simulate is not None:
+        game.load_level(args.level)
+        start = time.perf_counter()
+        game.run(args.simulate)
+        duration = time.perf_counter() - start
+        print("{} ticks in {:.3f} s ({:.0f} ticks per second)".format(
+            args.simulate, duration, args.simulate / max(duration, 1e-9)))
+        raise SystemExit
 
-if __name__ == '__main__':
     clock = pygame.time.Clock()
-    game = Game()
-    player = game.player
-    game.load_level(0)
     pygame.init()
     screen = pygame.display.set_mode((640, 400))
+    # show the window before the level and the textures are loaded
+    pygame.display.flip()
+    # the level is prepared in the background while textures are loaded, next levels are prepared while playing
+    game.prefetch_levels = True
+    game.prefetch(args.level)
+    if args.workers > 0:
+        # imported only when needed (multiprocessing is slow to import)
+        from parallel import ParallelRenderer
+        renderer = ParallelRenderer(screen.get_width(), screen.get_height(), workers=args.workers, mode=args.mode)
+    else:
+        renderer = Renderer(screen.get_width(), screen.get_height(), mode=args.mode)
+    if args.replay:
+        demo = load_demo(args.replay)
+        durations, interrupted = replay(game, demo, renderer, screen, window=True)
+        print_header()
+        print_report(args.replay, len(demo), durations, interrupted or demo.in_sync(game))
+        if args.workers > 0:
+            renderer.close()
+        raise SystemExit
+    game.load_level(args.level)
+    demo = Demo(args.level) if args.record else None
+    if args.profile or args.trace:
+        profiler = Profiler(trace=args.trace is not None)
+    else:
+        profiler = NULL_PROFILER
+    renderer.profiler = profiler
     running = True
-
+    # time not simulated yet
+    accumulator = 0
+    last_time = time.perf_counter()
 
     while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-        pressed_keys = pygame.key.get_pressed()
-        if pressed_keys[pygame.K_UP]:
-            player.move(1)
-        elif pressed_keys[pygame.K_DOWN]:
-            player.move(-1)
-        if pressed_keys[pygame.K_RIGHT]:
-            player.turn(1)
-        elif pressed_keys[pygame.K_LEFT]:
-            player.turn(-1)
+        with profiler.stage('events'):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+            actions = keyboard_actions(pygame.key.get_pressed())
+        with profiler.stage('update'):
+            now = time.perf_counter()
+            accumulator += min(now - last_time, MAX_FRAME_DURATION)
+            last_time = now
+            while accumulator >= TICK_DURATION:
+                if demo is not None:
+                    demo.record(actions)
+                game.tick(actions)
+                accumulator -= TICK_DURATION
 
-        draw_walls(screen)
-        pygame.display.flip()
+        # the view is drawn between the last two ticks
+        with player.interpolate(accumulator / TICK_DURATION):
+            renderer.draw(game, screen)
+        if args.profile:
+            profiler.draw_overlay(screen)
+        with profiler.stage('flip'):
+            pygame.display.flip()
 
-        clock.tick(60)
-        # print(clock.get_fps())
+        with profiler.stage('wait'):
+            clock.tick(args.fps)
 
+    if args.trace:
+        profiler.save_trace(args.trace)
+    if args.record:
+        demo.save(args.record, game)
+    if args.workers > 0:
+        renderer.close()
@@ -0,0 +1,164 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+from game import Game
+from renderer import Renderer
+
+# renderer and game used by a worker process (set by `init_worker`)
+worker_renderer = None
+worker_game = None
+
+
+class SharedMap:
+    """
+    Copy of the level data used by the ray caster, stored in a shared memory block so that it can be read by worker
+    processes (it has the same attributes as `game.Map` for everything `engine.cast_rays` needs, including the state
+    of doors and pushwalls)
+    """
+    # name, dtype and shape of the shared arrays (the arrays of animated cells are large enough for any level)
+    FIELDS = [
+        ('plane0', np.dtype('<u2'), (64, 64)),
+        ('kind', np.dtype(np.uint8), (64, 64)),
+        ('slot', np.dtype(np.int16), (64, 64)),
+        ('offset', np.dtype(np.float64), (64 * 64,)),
+        ('direction', np.dtype(np.int8), (64 * 64, 2)),
+    ]
+    SIZE = sum(dtype.itemsize * int(np.prod(shape)) for name, dtype, shape in FIELDS)
+
+    def __init__(self, buffer):
+        """
+        Initializer
+        :param buffer: shared memory buffer (at least `SharedMap.SIZE` bytes long)
+        """
+        offset = 0
+        for name, dtype, shape in self.FIELDS:
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset))
+            offset += dtype.itemsize * int(np.prod(shape))
+
+    def update(self, level_map):
+        """
+        Copy the current state of a level in the shared arrays
+        :param level_map: a `game.Map` instance
+        """
+        for name, dtype, shape in self.FIELDS:
+            value = getattr(level_map, name)
+            getattr(self, name)[:len(value)] = value
+
+
+def init_worker(width, height, fov, mode, framebuffer_name, depth_name, map_name):
+    """
+    Initialize a worker process: its renderer writes directly in the shared framebuffer and depth buffer
+    """
+    global worker_renderer, worker_game
+    # keep references to the shared memory blocks so that they are not closed while the worker is running
+    blocks = [shared_memory.SharedMemory(name=name) for name in (framebuffer_name, depth_name, map_name)]
+    worker_renderer = Renderer(width, height, fov, mode)
+    worker_renderer.shared_memory = blocks
+    worker_renderer.framebuffer = np.ndarray((width, height), dtype=np.uint8, buffer=blocks[0].buf)
+    worker_renderer.t = np.ndarray(width, dtype=np.float64, buffer=blocks[1].buf)
+    worker_game = Game()
+    worker_game.map = SharedMap(blocks[2].buf)
+
+
+def render_strip(x, y, dx, dy, start, stop):
+    """
+    Cast rays and fill a strip of columns of the shared framebuffer (executed in a worker process)
+    """
+    player = worker_game.player
+    player.x, player.y, player.dx, player.dy = x, y, dx, dy
+    worker_renderer.cast(worker_game, start, stop)
+    worker_renderer.fill(start, stop)
+    worker_renderer.draw_floor(worker_game, start, stop)
+
+
+class ParallelRenderer(Renderer):
+    """
+    Renderer that splits the screen in vertical strips, rendered by a pool of workers.
+    With processes, the framebuffer, the depth buffer and the level data are in shared memory and each worker writes
+    its strips directly in the shared framebuffer. Sprites and blitting are done by the main process.
+    Note: the `cast` stage casts rays and fills the framebuffer (including the ceiling and the floor), `fill` and
+    `draw_floor` do nothing.
+    """
+    def __init__(self, width, height, fov=1, workers=None, threads=False, mode='flat'):
+        """
+        Initializer
+        :param width: width of the rendered image in pixels
+        :param height: height of the rendered image in pixels
+        :param fov: field of vision (half-width of the camera plane)
+        :param workers: number of workers (defaults to the number of CPUs)
+        :param threads: use threads instead of processes (only useful if NumPy releases the GIL for most of the work)
+        :param mode: way of drawing the ceiling and the floor (one of renderer.RENDER_MODES)
+        """
+        super().__init__(width, height, fov, mode)
+        # strips are cast and filled together by the workers, previous rays are not reused
+        self.frame_coherence = False
+        self.workers = workers or os.cpu_count()
+        self.threads = threads
+        # two strips per worker to balance strips that are slower to render
+        bounds = np.linspace(0, width, 2 * self.workers + 1).astype(int).tolist()
+        self.strips = [(start, stop) for start, stop in zip(bounds, bounds[1:]) if start < stop]
+        self.shared_memory = []
+        if threads:
+            self.executor = ThreadPoolExecutor(self.workers)
+            return
+
+        framebuffer_block = shared_memory.SharedMemory(create=True, size=width * height)
+        depth_block = shared_memory.SharedMemory(create=True, size=8 * width)
+        map_block = shared_memory.SharedMemory(create=True, size=SharedMap.SIZE)
+        self.shared_memory = [framebuffer_block, depth_block, map_block]
+        self.framebuffer = np.ndarray((width, height), dtype=np.uint8, buffer=framebuffer_block.buf)
+        self.t = np.ndarray(width, dtype=np.float64, buffer=depth_block.buf)
+        self.shared_map = SharedMap(map_block.buf)
+        self.pool = Pool(self.workers, initializer=init_worker, initargs=(
+            width, height, fov, mode, framebuffer_block.name, depth_block.name, map_block.name))
+
+    def cast(self, game, start=0, stop=None):
+        """
+        Cast rays and fill the framebuffer, each strip being processed by a worker
+        :param game: the current game
+        """
+        player = game.player
+        if self.threads:
+            def render(strip):
+                Renderer.cast(self, game, *strip)
+                Renderer.fill(self, *strip)
+                Renderer.draw_floor(self, game, *strip)
+            list(self.executor.map(render, self.strips))
+        else:
+            self.shared_map.update(game.map)
+            self.pool.starmap(render_strip, [
+                (player.x, player.y, player.dx, player.dy, strip_start, strip_stop)
+                for strip_start, strip_stop in self.strips])
+
+    def fill(self, start=0, stop=None):
+        """
+        Nothing to do, strips are filled by the workers in `cast`
+        """
+        pass
+
+    def draw_floor(self, game, start=0, stop=None):
+        """
+        Nothing to do, the ceiling and the floor are drawn by the workers in `cast`
+        """
+        pass
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory
+        """
+        if self.threads:
+            self.executor.shutdown()
+            return
+        # workers are not terminated with a signal: when forked from a process where pygame is initialized, SDL
+        # handles SIGTERM in the workers and they would not stop
+        self.pool.close()
+        self.pool.join()
+        # arrays must not use the shared buffers anymore before the blocks are closed
+        self.framebuffer = np.array(self.framebuffer)
+        self.t = np.array(self.t)
+        del self.shared_map
+        for block in self.shared_memory:
+            block.close()
+            block.unlink()
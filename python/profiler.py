@@ -0,0 +1,190 @@
+import json
+import os
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import pygame
+
+# colors of the overlay text and background
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+# percentiles reported by `stats`
+PERCENTILES = [50, 90, 99]
+
+
+def stats(samples):
+    """
+    Summary statistics of a list of durations
+    :param samples: durations in seconds
+    :return: dictionary of statistics in milliseconds
+    """
+    samples = 1000 * np.asarray(samples)
+    result = {'mean': float(samples.mean()), 'max': float(samples.max())}
+    for p, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        result['p{}'.format(p)] = float(value)
+    return result
+
+
+def offscreen_surface(width, height):
+    """
+    Initialize pygame to render off-screen (no window is needed) and create a surface on which frames can be drawn
+    :param width: width of the surface in pixels
+    :param height: height of the surface in pixels
+    :return: a pygame surface
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    return pygame.Surface((width, height))
+
+
+class Profiler:
+    """
+    Timers for the stages of the game loop.
+    The last durations of each stage are kept in a ring buffer to compute rolling statistics, and all measures can
+    optionally be recorded as a trace file in the Chrome trace event format (that can be opened in chrome://tracing,
+    Perfetto or speedscope).
+    """
+    def __init__(self, size=120, trace=False):
+        """
+        Initializer
+        :param size: number of durations kept for each stage
+        :param trace: whether all measures should be recorded to be saved as a trace file
+        """
+        self.size = size
+        self.durations = {}
+        self.counts = {}
+        self.trace_events = [] if trace else None
+        self.origin = time.perf_counter()
+        # lines of text displayed by `draw_overlay` and number of frames since they were last updated
+        self.overlay_lines = []
+        self.overlay_age = 0
+        self.font = None
+
+    def stage(self, name):
+        """
+        Context manager measuring the duration of a stage
+        :param name: name of the stage
+        """
+        return Timer(self, name)
+
+    def record(self, name, start, end):
+        """
+        Record the duration of a stage
+        :param name: name of the stage
+        :param start: start time (as given by time.perf_counter)
+        :param end: end time (as given by time.perf_counter)
+        """
+        if name not in self.durations:
+            self.durations[name] = np.zeros(self.size)
+            self.counts[name] = 0
+        self.durations[name][self.counts[name] % self.size] = end - start
+        self.counts[name] += 1
+        if self.trace_events is not None:
+            self.trace_events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': 1e6 * (start - self.origin),
+                'dur': 1e6 * (end - start),
+                'pid': 0,
+                'tid': 0,
+            })
+
+    def samples(self, name):
+        """
+        Last durations of a stage
+        :param name: name of the stage
+        :return: array of durations in seconds
+        """
+        return self.durations[name][:min(self.counts[name], self.size)]
+
+    def average(self, name):
+        """
+        Rolling average duration of a stage
+        :param name: name of the stage
+        :return: average duration in seconds
+        """
+        return float(self.samples(name).mean())
+
+    def percentile(self, name, q=99):
+        """
+        Rolling percentile of the duration of a stage
+        :param name: name of the stage
+        :param q: percentile to compute (in [0, 100])
+        :return: duration in seconds
+        """
+        return float(np.percentile(self.samples(name), q))
+
+    def summary(self):
+        """
+        Rolling statistics of all stages
+        :return: list of (name, average, 99th percentile) tuples, durations in milliseconds
+        """
+        return [(name, 1000 * self.average(name), 1000 * self.percentile(name)) for name in self.durations]
+
+    def save_trace(self, filename):
+        """
+        Write all recorded measures to a trace file (JSON)
+        :param filename: name of the file
+        """
+        with open(filename, 'w') as fp:
+            json.dump({'traceEvents': self.trace_events or [], 'displayTimeUnit': 'ms'}, fp)
+
+    def draw_overlay(self, screen, refresh=15):
+        """
+        Display the average and 99th percentile duration of each stage in the top left corner of the screen
+        :param screen: target surface
+        :param refresh: number of frames between updates of the displayed values
+        """
+        if self.font is None:
+            self.font = pygame.font.SysFont('monospace', 13)
+        if self.overlay_age % refresh == 0:
+            self.overlay_lines = [
+                self.font.render('{:<8} {:6.2f} {:6.2f}'.format(name, average, p99), False, WHITE, BLACK)
+                for name, average, p99 in self.summary()
+            ]
+        self.overlay_age += 1
+        for i, line in enumerate(self.overlay_lines):
+            screen.blit(line, (4, 4 + 14 * i))
+
+
+class Timer:
+    """
+    Context manager used by `Profiler.stage`
+    """
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+
+
+class NullProfiler:
+    """
+    Profiler that does nothing, used when instrumentation is disabled
+    """
+    context = nullcontext()
+
+    def stage(self, name):
+        return self.context
+
+    def record(self, name, start, end):
+        pass
+
+    def summary(self):
+        return []
+
+    def save_trace(self, filename):
+        pass
+
+    def draw_overlay(self, screen, refresh=15):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
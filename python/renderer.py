@@ -0,0 +1,489 @@
+from functools import lru_cache
+import pygame
+import numpy as np
+from engine import cast_rays
+from game import VSwap, load_bundle
+from profiler import NULL_PROFILER
+
+
+# Wolfenstein 3D color palette (hard-coded in executable)
+palette = [(0, 0, 0), (0, 0, 168), (0, 168, 0), (0, 168, 168), (168, 0, 0), (168, 0, 168), (168, 84, 0),
+           (168, 168, 168), (84, 84, 84), (84, 84, 252), (84, 252, 84), (84, 252, 252), (252, 84, 84), (252, 84, 252),
+           (252, 252, 84), (252, 252, 252), (236, 236, 236), (220, 220, 220), (208, 208, 208), (192, 192, 192),
+           (180, 180, 180), (168, 168, 168), (152, 152, 152), (140, 140, 140), (124, 124, 124), (112, 112, 112),
+           (100, 100, 100), (84, 84, 84), (72, 72, 72), (56, 56, 56), (44, 44, 44), (32, 32, 32), (252, 0, 0),
+           (236, 0, 0), (224, 0, 0), (212, 0, 0), (200, 0, 0), (188, 0, 0), (176, 0, 0), (164, 0, 0), (152, 0, 0),
+           (136, 0, 0), (124, 0, 0), (112, 0, 0), (100, 0, 0), (88, 0, 0), (76, 0, 0), (64, 0, 0), (252, 216, 216),
+           (252, 184, 184), (252, 156, 156), (252, 124, 124), (252, 92, 92), (252, 64, 64), (252, 32, 32), (252, 0, 0),
+           (252, 168, 92), (252, 152, 64), (252, 136, 32), (252, 120, 0), (228, 108, 0), (204, 96, 0), (180, 84, 0),
+           (156, 76, 0), (252, 252, 216), (252, 252, 184), (252, 252, 156), (252, 252, 124), (252, 248, 92),
+           (252, 244, 64), (252, 244, 32), (252, 244, 0), (228, 216, 0), (204, 196, 0), (180, 172, 0), (156, 156, 0),
+           (132, 132, 0), (112, 108, 0), (88, 84, 0), (64, 64, 0), (208, 252, 92), (196, 252, 64), (180, 252, 32),
+           (160, 252, 0), (144, 228, 0), (128, 204, 0), (116, 180, 0), (96, 156, 0), (216, 252, 216), (188, 252, 184),
+           (156, 252, 156), (128, 252, 124), (96, 252, 92), (64, 252, 64), (32, 252, 32), (0, 252, 0), (0, 252, 0),
+           (0, 236, 0), (0, 224, 0), (0, 212, 0), (4, 200, 0), (4, 188, 0), (4, 176, 0), (4, 164, 0), (4, 152, 0),
+           (4, 136, 0), (4, 124, 0), (4, 112, 0), (4, 100, 0), (4, 88, 0), (4, 76, 0), (4, 64, 0), (216, 252, 252),
+           (184, 252, 252), (156, 252, 252), (124, 252, 248), (92, 252, 252), (64, 252, 252), (32, 252, 252),
+           (0, 252, 252), (0, 228, 228), (0, 204, 204), (0, 180, 180), (0, 156, 156), (0, 132, 132), (0, 112, 112),
+           (0, 88, 88), (0, 64, 64), (92, 188, 252), (64, 176, 252), (32, 168, 252), (0, 156, 252), (0, 140, 228),
+           (0, 124, 204), (0, 108, 180), (0, 92, 156), (216, 216, 252), (184, 188, 252), (156, 156, 252),
+           (124, 128, 252), (92, 96, 252), (64, 64, 252), (32, 36, 252), (0, 4, 252), (0, 0, 252), (0, 0, 236),
+           (0, 0, 224), (0, 0, 212), (0, 0, 200), (0, 0, 188), (0, 0, 176), (0, 0, 164), (0, 0, 152), (0, 0, 136),
+           (0, 0, 124), (0, 0, 112), (0, 0, 100), (0, 0, 88), (0, 0, 76), (0, 0, 64), (40, 40, 40), (252, 224, 52),
+           (252, 212, 36), (252, 204, 24), (252, 192, 8), (252, 180, 0), (180, 32, 252), (168, 0, 252), (152, 0, 228),
+           (128, 0, 204), (116, 0, 180), (96, 0, 156), (80, 0, 132), (68, 0, 112), (52, 0, 88), (40, 0, 64),
+           (252, 216, 252), (252, 184, 252), (252, 156, 252), (252, 124, 252), (252, 92, 252), (252, 64, 252),
+           (252, 32, 252), (252, 0, 252), (224, 0, 228), (200, 0, 204), (180, 0, 180), (156, 0, 156), (132, 0, 132),
+           (108, 0, 112), (88, 0, 88), (64, 0, 64), (252, 232, 220), (252, 224, 208), (252, 216, 196), (252, 212, 188),
+           (252, 204, 176), (252, 196, 164), (252, 188, 156), (252, 184, 144), (252, 176, 128), (252, 164, 112),
+           (252, 156, 96), (240, 148, 92), (232, 140, 88), (220, 136, 84), (208, 128, 80), (200, 124, 76),
+           (188, 120, 72), (180, 112, 68), (168, 104, 64), (160, 100, 60), (156, 96, 56), (144, 92, 52), (136, 88, 48),
+           (128, 80, 44), (116, 76, 40), (108, 72, 36), (92, 64, 32), (84, 60, 28), (72, 56, 24), (64, 48, 24),
+           (56, 44, 20), (40, 32, 12), (96, 0, 100), (0, 100, 100), (0, 96, 96), (0, 0, 28), (0, 0, 44), (48, 36, 16),
+           (72, 0, 72), (80, 0, 80), (0, 0, 52), (28, 28, 28), (76, 76, 76), (92, 92, 92), (64, 64, 64), (48, 48, 48),
+           (52, 52, 52), (216, 244, 244), (184, 232, 232), (156, 220, 220), (116, 200, 200), (72, 192, 192),
+           (32, 180, 180), (32, 176, 176), (0, 164, 164), (0, 152, 152), (0, 140, 140), (0, 132, 132), (0, 124, 124),
+           (0, 120, 120), (0, 116, 116), (0, 112, 112), (0, 108, 108), (152, 0, 136)]
+
+# palette indexes of ceiling and floor colors
+CEILING_COLOR = 29
+FLOOR_COLOR = 25
+# sprites closer than this distance to the camera are not drawn
+NEAR_DISTANCE = .25
+# indexes of the ceiling and floor colors in the colors of a column (after the 64 texels of the wall)
+CEILING_ROW = 64
+FLOOR_ROW = 65
+# walls higher than this number of screen heights are drawn with the largest entry of the texture rows table
+MAX_WALL_SCALE = 8
+# number of entries of the texture rows table computed at once
+TABLE_CHUNK = 256
+# ways of drawing the ceiling and the floor: flat colors, colors darkened with distance (walls are also darkened), or
+# textures darkened with distance
+RENDER_MODES = ['flat', 'shaded', 'textured']
+# number of shading tables, distance at which surfaces get the darkest shade and intensity of the darkest shade
+SHADE_LEVELS = 16
+SHADE_DISTANCE = 16
+MAX_SHADE = .75
+# wall textures used for the ceiling and the floor in textured mode
+CEILING_TEXTURE = 1
+FLOOR_TEXTURE = 0
+
+
+@lru_cache(maxsize=1)
+def load_textures():
+    """
+    Load the textures used by renderers. They are loaded once per process and shared by all renderers (and by
+    processes forked after they were loaded), they must not be modified.
+    :return: tuple (vswap, wall_textures, sprite_texels, sprite_bounds) where
+    - vswap is the `game.VSwap` instance containing the textures (None if they are read from the asset bundle)
+    - wall_textures is an array of shape (number of walls, 64, 64) of palette indexes
+    - sprite_texels is an array of shape (number of sprites, 64, 64) of palette indexes, with transparent pixels
+    marked as 256 (out of the palette)
+    - sprite_bounds is a list of the bounds [x_min, x_max, y_min, y_max] of the opaque part of each sprite (in texels)
+    """
+    bundle = load_bundle()
+    if bundle is not None:
+        vswap = None
+        wall_textures = bundle['walls']
+        pixels, masks = bundle['sprite_pixels'], bundle['sprite_masks']
+    else:
+        vswap = VSwap()
+        wall_textures = vswap.walls()
+        pixels, masks = vswap.sprites()
+    sprite_texels = np.where(masks, pixels, np.uint16(256))
+    opaque_x = masks.any(axis=2)
+    opaque_y = masks.any(axis=1)
+    sprite_bounds = np.stack([
+        opaque_x.argmax(axis=1), 64 - opaque_x[:, ::-1].argmax(axis=1),
+        opaque_y.argmax(axis=1), 64 - opaque_y[:, ::-1].argmax(axis=1)], axis=1).tolist()
+    return vswap, wall_textures, sprite_texels, sprite_bounds
+
+
+@lru_cache(maxsize=1)
+def shading_tables():
+    """
+    Tables of darker colors for distance shading
+    :return: array of shape (SHADE_LEVELS, 256), where table[level, color] is the palette index of the color closest to
+    color darkened by the shading level (from 0 for no shading to MAX_SHADE for the last level)
+    """
+    colors = np.array(palette, dtype=np.float64)
+    tables = np.empty((SHADE_LEVELS, len(palette)), dtype=np.uint8)
+    for level in range(SHADE_LEVELS):
+        dark = colors * (1 - MAX_SHADE * level / (SHADE_LEVELS - 1))
+        tables[level] = ((dark[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    return tables
+
+
+def shade_levels(distance):
+    """
+    Shading levels of surfaces seen at some distances from the camera
+    :param distance: array of distances
+    :return: array of indexes of shading tables
+    """
+    return np.minimum((distance * (SHADE_LEVELS / SHADE_DISTANCE)).astype(np.intp), SHADE_LEVELS - 1)
+
+
+class Camera:
+    """
+    Projection tables for a screen resolution and field of vision. The tables are only rebuilt when the resolution or
+    the field of vision changes so that rendering a frame only needs array arithmetic.
+    """
+    def __init__(self, width, height, fov=1):
+        """
+        Initializer
+        :param width: width of the rendered image in pixels
+        :param height: height of the rendered image in pixels
+        :param fov: field of vision (half-width of the camera plane)
+        """
+        self.width = None
+        self.height = None
+        self.fov = None
+        self.update(width, height, fov)
+
+    def update(self, width, height, fov=1):
+        """
+        Rebuild the tables if the resolution or the field of vision changed
+        :param width: width of the rendered image in pixels
+        :param height: height of the rendered image in pixels
+        :param fov: field of vision (half-width of the camera plane)
+        :return: whether the tables were rebuilt
+        """
+        if (width, height, fov) == (self.width, self.height, self.fov):
+            return False
+        self.width = width
+        self.height = height
+        self.fov = fov
+        # height in pixels of a wall at distance 1
+        self.wall_height = width / (2 * fov)
+        # position of each screen column on the camera plane
+        self.shift = (fov * (2 * np.arange(width)) - width) / width
+
+        # texel_rows[i, y] is the texture row drawn on the screen row y of a column where the wall is i pixels high
+        # (i is rounded to the nearest integer), or CEILING_ROW / FLOOR_ROW if the pixel is above / below the wall
+        self.max_height_index = MAX_WALL_SCALE * height
+        self.texel_rows = np.empty((self.max_height_index + 1, height), dtype=np.uint8)
+        self.ceiling_end = np.empty(self.max_height_index + 1, dtype=np.intp)
+        self.floor_start = np.empty(self.max_height_index + 1, dtype=np.intp)
+        rows = np.arange(height, dtype=np.float64)
+        for start in range(0, self.max_height_index + 1, TABLE_CHUNK):
+            stop = min(start + TABLE_CHUNK, self.max_height_index + 1)
+            h = np.maximum(np.arange(start, stop) / 2, .25)[:, None]  # half height of the wall
+            texel_y = (rows - (height / 2 - h)) * (32 / h)
+            table = self.texel_rows[start: stop]
+            np.copyto(table, np.clip(texel_y, 0, 63), casting='unsafe')
+            table[texel_y < 0] = CEILING_ROW
+            table[texel_y >= 64] = FLOOR_ROW
+            # number of ceiling rows and first floor row of each entry of the table
+            self.ceiling_end[start: stop] = (table == CEILING_ROW).sum(axis=1)
+            self.floor_start[start: stop] = height - (table == FLOOR_ROW).sum(axis=1)
+
+        # rows of the lower half of the screen (the ceiling is drawn as a mirror of the floor), distance of the floor
+        # seen on each of them (measured like the distance to walls) and its shading level
+        self.floor_rows = np.arange(height // 2, height)
+        self.row_distance = self.wall_height / (2 * np.maximum(self.floor_rows + .5 - height / 2, .5))
+        self.row_shade = shade_levels(self.row_distance)
+        return True
+
+
+class Renderer:
+    """
+    Draws the player's view of the level into a persistent 8-bit framebuffer of palette indexes
+    """
+    def __init__(self, width, height, fov=1, mode='flat'):
+        """
+        Initializer
+        :param width: width of the rendered image in pixels
+        :param height: height of the rendered image in pixels
+        :param fov: field of vision (half-width of the camera plane)
+        :param mode: way of drawing the ceiling and the floor (one of RENDER_MODES)
+        """
+        self.vswap, self.wall_textures, self.sprite_texels, self.sprite_bounds = load_textures()
+        if mode not in RENDER_MODES:
+            raise ValueError("Unknown render mode: {}".format(mode))
+        self.mode = mode
+        self.shades = shading_tables() if mode != 'flat' else None
+
+        # timers of the rendering stages (see profiler.Profiler)
+        self.profiler = NULL_PROFILER
+        # reuse the rays and the image of the previous frame when the camera is static (see `render`)
+        self.frame_coherence = True
+
+        # size of the buffers (set by `resize`)
+        self.width = self.height = None
+        self.camera = None
+        self.resize(width, height, fov)
+
+    def resize(self, width, height, fov=1):
+        """
+        Change the resolution or the field of vision of the rendered image (buffers and projection tables are only
+        rebuilt if they changed)
+        :param width: width of the rendered image in pixels
+        :param height: height of the rendered image in pixels
+        :param fov: field of vision (half-width of the camera plane)
+        """
+        if self.camera is None:
+            self.camera = Camera(width, height, fov)
+        elif not self.camera.update(width, height, fov):
+            return
+        self.fov = fov
+        self.wall_height = self.camera.wall_height
+        self.view = None
+        if (self.width, self.height) == (width, height):
+            return
+        self.width = width
+        self.height = height
+
+        # framebuffer of palette indexes, indexed as framebuffer[x, y] (same layout as pygame.surfarray)
+        self.framebuffer = np.zeros((width, height), dtype=np.uint8)
+        self.surface = pygame.Surface((width, height), depth=8)
+        self.surface.set_palette(palette)
+
+        # work arrays reused at each frame
+        # colors that can be drawn on each column: the 64 texels of the wall, followed by ceiling and floor colors
+        self.column_colors = np.empty((width, 66), dtype=np.uint8)
+        self.column_colors[:, CEILING_ROW] = CEILING_COLOR
+        self.column_colors[:, FLOOR_ROW] = FLOOR_COLOR
+        self.column_offset = 66 * np.arange(width)[:, None]
+        self.texel_y = np.empty((width, height), dtype=np.uint8)
+        self.texel_index = np.empty((width, height), dtype=np.intp)
+
+        # results of the last ray cast (one value per column), t is the distance to the wall and is used as a depth
+        # buffer when drawing sprites
+        self.t = np.ones(width)
+        self.texture_index = np.zeros(width, dtype=np.intp)
+        self.tx = np.zeros(width)
+
+        # camera (x, y, dx, dy) and state of the level of the last ray cast, image of the walls of the last frame and
+        # sprites drawn over it (see `render`)
+        self.view = None
+        self.view_map = None
+        self.view_kind = None
+        self.view_offset = None
+        self.walls = np.zeros((width, height), dtype=np.uint8)
+        self.sprites = None
+
+    def cast(self, game, start=0, stop=None):
+        """
+        Cast a ray for each screen column from the player's position
+        :param game: the current game (its map and player are used)
+        :param start: first column to cast
+        :param stop: end of the range of columns to cast (last column + 1, defaults to the width of the screen)
+        """
+        if stop is None:
+            stop = self.width
+        player = game.player
+        shift = self.camera.shift[start: stop]
+        rdx = player.dx - shift * player.dy
+        rdy = player.dy + shift * player.dx
+        rx, ry, self.t[start: stop], self.texture_index[start: stop], self.tx[start: stop] = cast_rays(
+            game.map, player.x, player.y, rdx, rdy)
+
+    def update_rays(self, game):
+        """
+        Cast rays for a new frame, unless the camera and the level did not change since the last ray cast
+        :param game: the current game
+        :return: whether the rays were cast
+        """
+        player = game.player
+        level_map = game.map
+        view = (player.x, player.y, player.dx, player.dy)
+        if (view == self.view and level_map is self.view_map and np.array_equal(level_map.kind, self.view_kind) and
+                np.array_equal(level_map.offset, self.view_offset)):
+            return False
+        self.cast(game)
+        self.view = view
+        self.view_map = level_map
+        self.view_kind = level_map.kind.copy()
+        self.view_offset = level_map.offset.copy()
+        return True
+
+    def fill(self, start=0, stop=None):
+        """
+        Fill the framebuffer with textured walls, ceiling and floor from the results of the last ray cast
+        :param start: first column to fill
+        :param stop: end of the range of columns to fill (last column + 1, defaults to the width of the screen)
+        """
+        if stop is None:
+            stop = self.width
+        columns = slice(start, stop)
+        camera = self.camera
+        # height of the wall on each column in pixels, used as an index in the table of texture rows
+        height_index = np.minimum(np.rint(camera.wall_height / self.t[columns]), camera.max_height_index)
+        texel_y = self.texel_y[columns]
+        np.take(camera.texel_rows, height_index.astype(np.intp), axis=0, out=texel_y)
+
+        # texels of the column of the wall texture drawn on each screen column
+        texel_x = np.minimum((64 * self.tx[columns]).astype(np.intp), 63)
+        if self.shades is None:
+            self.column_colors[columns, :64] = self.wall_textures[self.texture_index[columns], texel_x]
+        else:
+            self.column_colors[columns, :64] = self.shades[
+                shade_levels(self.t[columns])[:, None], self.wall_textures[self.texture_index[columns], texel_x]]
+
+        texel_index = self.texel_index[columns]
+        np.add(texel_y, self.column_offset[columns], out=texel_index)
+        np.take(self.column_colors, texel_index, out=self.framebuffer[columns])
+
+    def draw_floor(self, game, start=0, stop=None):
+        """
+        Draw the ceiling and the floor over the flat colors drawn by `fill` (in shaded and textured modes). Each row
+        of the floor is at the same distance from the camera, so positions on the floor are interpolated along rows
+        and shading levels are computed once per row. The ceiling is drawn as a mirror of the floor.
+        :param game: the current game (its player is used)
+        :param start: first column to draw
+        :param stop: end of the range of columns to draw (last column + 1, defaults to the width of the screen)
+        """
+        if self.mode == 'flat':
+            return
+        if stop is None:
+            stop = self.width
+        columns = slice(start, stop)
+        camera = self.camera
+        height_index = np.minimum(np.rint(camera.wall_height / self.t[columns]), camera.max_height_index).astype(
+            np.intp)
+        rows = camera.floor_rows
+        # pixels of the lower half of the columns that are below the wall, and of the upper half above the wall
+        # (indexed by the mirrored row in the lower half)
+        floor = rows >= camera.floor_start[height_index][:, None]
+        ceiling = rows > self.height - 1 - camera.ceiling_end[height_index][:, None]
+
+        if self.mode == 'shaded':
+            floor_colors = self.shades[camera.row_shade, FLOOR_COLOR]
+            ceiling_colors = self.shades[camera.row_shade, CEILING_COLOR]
+        else:
+            player = game.player
+            shift = camera.shift[columns]
+            rdx = player.dx - shift * player.dy
+            rdy = player.dy + shift * player.dx
+            # texels of the floor seen on each pixel, interpolated between the ends of each row
+            texel_x = (64 * (player.x + rdx[:, None] * camera.row_distance)).astype(np.intp) & 63
+            texel_y = (64 * (player.y + rdy[:, None] * camera.row_distance)).astype(np.intp) & 63
+            floor_colors = self.shades[camera.row_shade, self.wall_textures[FLOOR_TEXTURE][texel_x, texel_y]]
+            ceiling_colors = self.shades[camera.row_shade, self.wall_textures[CEILING_TEXTURE][texel_x, texel_y]]
+        np.copyto(self.framebuffer[columns, rows[0]:], floor_colors, where=floor)
+        np.copyto(self.framebuffer[columns, self.height - 1 - rows[0]::-1], ceiling_colors, where=ceiling)
+
+    def draw_sprites(self, game):
+        """
+        Draw the things and enemies of the level as billboards over the walls
+        :param game: the current game
+        """
+        self.draw_billboards(game.player, *self.visible_sprites(game))
+
+    def visible_sprites(self, game):
+        """
+        Things and enemies of the level that can be seen from the player's position
+        :param game: the current game
+        :return: arrays x, y, sprite_index of the sprites
+        """
+        things = game.things
+        nb_things = len(things)
+        enemies = game.enemies
+        x = np.fromiter((thing.x for thing in things), dtype=np.float64, count=nb_things)
+        y = np.fromiter((thing.y for thing in things), dtype=np.float64, count=nb_things)
+        sprite_index = np.fromiter((thing.sprite_index for thing in things), dtype=np.intp, count=nb_things)
+        if len(enemies) > 0:
+            x = np.concatenate([x, enemies.x])
+            y = np.concatenate([y, enemies.y])
+            sprite_index = np.concatenate([sprite_index, enemies.sprite_indexes(game.player)])
+        if game.visibility is not None:
+            # skip sprites in areas that are not connected to the player's area
+            visible = game.visibility.can_see(game.player.x, game.player.y, x, y)
+            x, y, sprite_index = x[visible], y[visible], sprite_index[visible]
+        return x, y, sprite_index
+
+    def draw_billboards(self, player, x, y, sprite_index):
+        """
+        Draw sprites facing the camera, from the farthest to the nearest. Columns of a sprite that are behind the
+        wall drawn on that column are not drawn.
+        :param player: the player (position of the camera)
+        :param x: array of x-coordinates of the centers of the sprites
+        :param y: array of y-coordinates of the centers of the sprites
+        :param sprite_index: array of sprite indexes
+        """
+        # coordinates in the camera space: depth along the player's direction, lateral along the camera plane
+        rx = x - player.x
+        ry = y - player.y
+        depth = rx * player.dx + ry * player.dy
+        lateral = ry * player.dx - rx * player.dy
+        # keep sprites in front of the player and inside the field of vision
+        visible = (depth > NEAR_DISTANCE) & (np.abs(lateral) < self.fov * depth + .5)
+        order = np.flatnonzero(visible)
+        order = order[np.argsort(-depth[order], kind='stable')]
+
+        size = self.wall_height / depth[order]  # rendered size of the sprite in pixels
+        left = (lateral[order] / depth[order] + self.fov) * self.wall_height - size / 2
+        top = (self.height - size) / 2
+        for k, i in enumerate(order.tolist()):
+            texel_size = size[k] / 64
+            x_min, x_max, y_min, y_max = self.sprite_bounds[sprite_index[i]]
+            # range of screen pixels covered by the opaque part of the sprite
+            c0 = max(int(np.ceil(left[k] + x_min * texel_size)), 0)
+            c1 = min(int(np.ceil(left[k] + x_max * texel_size)), self.width)
+            r0 = max(int(np.ceil(top[k] + y_min * texel_size)), 0)
+            r1 = min(int(np.ceil(top[k] + y_max * texel_size)), self.height)
+            if c0 >= c1 or r0 >= r1:
+                continue
+            # screen columns where the sprite is in front of the wall
+            columns = np.flatnonzero(self.t[c0: c1] > depth[i]) + c0
+            if columns.size == 0:
+                continue
+            texel_x = np.minimum(((columns - left[k]) / texel_size).astype(np.intp), 63)
+            texel_y = np.minimum(((np.arange(r0, r1) - top[k]) / texel_size).astype(np.intp), 63)
+            texels = self.sprite_texels[sprite_index[i]][texel_x[:, None], texel_y]
+            block = self.framebuffer[columns, r0: r1]
+            np.copyto(block, texels, where=texels < 256, casting='unsafe')
+            self.framebuffer[columns, r0: r1] = block
+
+    def blit(self, screen):
+        """
+        Copy the framebuffer to the screen (palette conversion is done by pygame when blitting the 8-bit surface)
+        :param screen: target surface
+        """
+        pygame.surfarray.blit_array(self.surface, self.framebuffer)
+        screen.blit(self.surface, (0, 0))
+
+    def render(self, game):
+        """
+        Render a full frame of the game in the framebuffer (without copying it to a surface).
+        If `frame_coherence` is set and the camera and the level did not change since the previous frame, rays are
+        not cast and walls are not drawn again, and sprites are only drawn if they changed.
+        :param game: the current game
+        """
+        if not self.frame_coherence:
+            with self.profiler.stage('cast'):
+                self.cast(game)
+            with self.profiler.stage('fill'):
+                self.fill()
+            with self.profiler.stage('floor'):
+                self.draw_floor(game)
+            with self.profiler.stage('sprites'):
+                self.draw_sprites(game)
+            return
+
+        with self.profiler.stage('cast'):
+            changed = self.update_rays(game)
+        with self.profiler.stage('fill'):
+            if changed:
+                self.fill()
+        with self.profiler.stage('floor'):
+            if changed:
+                self.draw_floor(game)
+                np.copyto(self.walls, self.framebuffer)
+        with self.profiler.stage('sprites'):
+            sprites = self.visible_sprites(game)
+            if changed or not all(np.array_equal(a, b) for a, b in zip(sprites, self.sprites)):
+                if not changed:
+                    np.copyto(self.framebuffer, self.walls)
+                self.draw_billboards(game.player, *sprites)
+                self.sprites = sprites
+
+    def draw(self, game, screen):
+        """
+        Render a full frame of the game on the screen
+        :param game: the current game
+        :param screen: target surface
+        """
+        self.render(game)
+        with self.profiler.stage('blit'):
+            self.blit(screen)
@@ -1,4 +1,5 @@
-import struct
+import numpy as np
+from game import VSwap
 
 VSWAP = "../data/VSWAP.WL6"
 MAPHEAD = "../data/MAPHEAD.WL6"
@@ -73,6 +74,8 @@ palette = [bytes(c) for c in [
     (0, 140, 140), (0, 132, 132), (0, 124, 124), (0, 120, 120),
     (0, 116, 116), (0, 112, 112), (0, 108, 108), (152, 0, 136),
 ]]
+palette_array = np.frombuffer(b''.join(palette), dtype=np.uint8).reshape((256, 3))
+palette_array_transparent = np.vstack([palette_array, [(0xFF, 0xFF, 0xFF)]]).astype(np.uint8)
 
 
 def make_wall_tileset(output_file="walls.ppm"):
@@ -80,20 +83,12 @@ def make_wall_tileset(output_file="walls.ppm"):
     Create a PPM image containing all wall tiles from the input file
     :param output_file: name of the PPM file that will be created
     """
-    tileset = bytearray()
-    with open(VSWAP, "rb") as fp:
-        nb_chunks, first_sprite, first_sound = struct.unpack('<3H', fp.read(6))
-        chunk_offset = struct.unpack('<{}I'.format(nb_chunks), fp.read(4 * nb_chunks))
-        chunk_length = struct.unpack('<{}H'.format(nb_chunks), fp.read(2 * nb_chunks))
-        for i in range(first_sprite):
-            fp.seek(chunk_offset[i])
-            data = fp.read(chunk_length[i])
-            for c in data:
-                tileset += palette[c]
+    vswap = VSwap(VSWAP)
+    tileset = palette_array[vswap.walls()].tobytes()
 
     with open(output_file, "wb") as fp:
         fp.write('P6\n'.encode('ascii'))
-        fp.write('64 {}\n'.format(64 * first_sprite).encode('ascii'))
+        fp.write('64 {}\n'.format(64 * vswap.nb_walls).encode('ascii'))
         fp.write('255\n'.encode('ascii'))
         fp.write(tileset)
 
@@ -106,20 +101,14 @@ def make_wall_sprites(output_prefix=""):
 
     Note: Because textures are written in the game file by columns, the resulting images appear to be "transposed".
     """
-    with open(VSWAP, "rb") as fp_in:
-        nb_chunks, first_sprite, first_sound = struct.unpack('<3H', fp_in.read(6))
-        chunk_offset = struct.unpack('<{}I'.format(nb_chunks), fp_in.read(4 * nb_chunks))
-        chunk_length = struct.unpack('<{}H'.format(nb_chunks), fp_in.read(2 * nb_chunks))
-        # process all textures
-        for i in range(first_sprite):
-            fp_in.seek(chunk_offset[i])
-            data = fp_in.read(chunk_length[i])
-            with open(output_prefix + "{:03}".format(i), "wb") as fp_out:
-                fp_out.write('P6\n'.encode('ascii'))
-                fp_out.write('64 64\n'.encode('ascii'))
-                fp_out.write('255\n'.encode('ascii'))
-                for c in data:
-                    fp_out.write(palette[c])
+    vswap = VSwap(VSWAP)
+    # process all textures
+    for i in range(vswap.nb_walls):
+        with open(output_prefix + "{:03}".format(i), "wb") as fp_out:
+            fp_out.write('P6\n'.encode('ascii'))
+            fp_out.write('64 64\n'.encode('ascii'))
+            fp_out.write('255\n'.encode('ascii'))
+            fp_out.write(palette_array[vswap.wall(i)].tobytes())
 
 
 def make_sprite_tileset(output_file="sprites.ppm", indexes=None):
@@ -128,53 +117,16 @@ def make_sprite_tileset(output_file="sprites.ppm", indexes=None):
     :param output_file: name of the PPM file that will be created
     :param indexes: list of indexes of sprites to add to the tileset
     """
-    tileset = bytearray()
-    with open(VSWAP, "rb") as fp:
-        nb_chunks, first_sprite, first_sound = struct.unpack('<3H', fp.read(6))
-        if indexes is None:
-            indexes = list(range(first_sound - first_sprite))
-        chunk_offset = struct.unpack('<{}I'.format(nb_chunks), fp.read(4 * nb_chunks))
-        chunk_length = struct.unpack('<{}H'.format(nb_chunks), fp.read(2 * nb_chunks))
-
-        for sprite_index in indexes:
-            sprite_index += first_sprite
-            # read the chunk to buffer
-            fp.seek(chunk_offset[sprite_index])
-            chunk_data = fp.read(chunk_length[sprite_index])
-            offset = 0
-            # read chunk header
-            first_column, last_column = struct.unpack('<HH', chunk_data[offset: offset + 4])
-            offset += 4
-            nb_columns = last_column - first_column + 1
-            first_post_offset = struct.unpack('<{}H'.format(nb_columns), chunk_data[offset: offset + nb_columns * 2])
-            offset += nb_columns * 2
-            pixel_pool_offset = offset
-
-            # fill blank columns
-            tileset += b'\xFF' * 192 * first_column
-            for post_offset in first_post_offset:
-                # fill a column
-                offset = post_offset
-                filled_rows = 0
-                while True:
-                    # read a post
-                    if chunk_data[offset] == 0 and chunk_data[offset + 1] == 0:
-                        break
-                    ending_row, pool_index, starting_row = struct.unpack('<HHH', chunk_data[offset: offset + 6])
-                    ending_row //= 2
-                    starting_row //= 2
-                    offset += 6
-                    tileset += b'\xFF' * 3 * (starting_row - filled_rows)
-                    for pixel_index in range(ending_row - starting_row):
-                        tileset += palette[chunk_data[pixel_pool_offset]]
-                        pixel_pool_offset += 1
-                    filled_rows = ending_row
-                tileset += b'\xFF' * 3 * (64 - filled_rows)
-            tileset += b'\xFF' * 192 * (64 - last_column - 1)
+    vswap = VSwap(VSWAP)
+    if indexes is None:
+        indexes = list(range(vswap.nb_sprites))
+    pixels, masks = vswap.sprites()
+    # transparent pixels use an extra white palette entry
+    colors = np.where(masks[indexes], pixels[indexes], np.uint16(256))
+    tileset = np.take(palette_array_transparent, colors, axis=0).tobytes()
 
     with open(output_file, "wb") as fp:
         fp.write('P6\n'.encode('ascii'))
         fp.write('64 {}\n'.format(64 * len(indexes)).encode('ascii'))
         fp.write('255\n'.encode('ascii'))
         fp.write(tileset)
-
@@ -0,0 +1,236 @@
+import copy
+import os
+import numpy as np
+from files import atomic_open
+
+# plane0 value of the first area code: floor cells have a plane0 value AREA_TILE + index of their area
+AREA_TILE = 107
+# plane0 value of floor cells that have no area code (ambush cells), they get the area of a neighbouring cell
+AMBUSH_TILE = 106
+# neighbours of a cell used to give an area to cells without area code (and to find the areas on both sides of doors)
+NEIGHBOURS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+
+def find_areas(plane0):
+    """
+    Area index of each cell of a level, from the area codes of plane0 (in the original game, sound propagates and
+    enemies wake up only between areas that are connected by open doors)
+    :param plane0: plane0 of the level, indexed as plane0[x, y]
+    :return: 2D array of area indexes (-1 for walls and doors)
+    """
+    areas = np.where(plane0 >= AREA_TILE, plane0.astype(np.int16) - AREA_TILE, -1).astype(np.int16)
+    # propagate areas to the floor cells that have no area code
+    missing = np.argwhere(plane0 == AMBUSH_TILE).tolist()
+    while missing:
+        remaining = []
+        for x, y in missing:
+            neighbour_areas = [areas[x + dx, y + dy] for dx, dy in NEIGHBOURS if areas[x + dx, y + dy] >= 0]
+            if neighbour_areas:
+                areas[x, y] = neighbour_areas[0]
+            else:
+                remaining.append((x, y))
+        if len(remaining) == len(missing):
+            break
+        missing = remaining
+    return areas
+
+
+def find_door_areas(areas, slot, door_cells):
+    """
+    Areas on both sides of each door
+    :param areas: 2D array of area indexes (as returned by `find_areas`)
+    :param slot: 2D array of the slots of animated cells (`game.Map.slot`)
+    :param door_cells: array of (x, y) coordinates of the door cells
+    :return: array of shape (number of slots, 2) of area indexes (-1 if the slot is not a door or a side has no area)
+    """
+    door_areas = np.full((int(slot.max()) + 1, 2), -1, dtype=np.int16)
+    for x, y in door_cells.tolist():
+        sides = [areas[x + dx, y + dy] for dx, dy in NEIGHBOURS if areas[x + dx, y + dy] >= 0][:2]
+        door_areas[slot[x, y], :len(sides)] = sides
+    return door_areas
+
+
+class Visibility:
+    """
+    Visibility index of a level: areas of the cells and areas connected through open doors (sprites and enemies in
+    areas that are not connected to the player's area cannot be seen), and a cache of line of sight tests between
+    cells
+    """
+    def __init__(self, level_map, cache_file=None):
+        """
+        Initializer
+        :param level_map: the level (a `game.Map` instance)
+        :param cache_file: name of the file where the areas of the level are saved (loaded if it exists)
+        """
+        self.map = level_map
+        door_cells = np.argwhere((level_map.plane0 >= 90) & (level_map.plane0 <= 101))
+        if cache_file is not None and os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                self.areas = data['areas']
+                self.door_areas = data['door_areas']
+        else:
+            self.areas = find_areas(level_map.plane0)
+            self.door_areas = find_door_areas(self.areas, level_map.slot, door_cells)
+            if cache_file is not None:
+                with atomic_open(cache_file) as fp:
+                    np.savez(fp, areas=self.areas, door_areas=self.door_areas)
+        self.nb_areas = max(int(self.areas.max()) + 1, 1)
+        # a door cell is seen from the areas on both of its sides: its first side is used as its area, the second one
+        # is stored in a separate grid
+        self.cell_areas = self.areas.copy()
+        self.cell_other_areas = np.full_like(self.areas, -1)
+        for x, y in door_cells.tolist():
+            self.cell_areas[x, y], self.cell_other_areas[x, y] = self.door_areas[level_map.slot[x, y]]
+        self.door_slots = level_map.slot[door_cells[:, 0], door_cells[:, 1]]
+        # doors that are not completely closed, areas connected through them and cached line of sight results
+        self.open_doors = None
+        self.connected = None
+        self.line_of_sight_cache = {}
+        # pairs of areas connected by other means than doors (pushwalls that were moved)
+        self.links = []
+        self.update()
+
+    def copy(self, level_map):
+        """
+        Copy of the index for a copy of the level (the data changed by doors and pushwalls is not shared)
+        :param level_map: the copy of the level (a `game.Map` instance)
+        :return: a `Visibility` instance
+        """
+        visibility = copy.copy(self)
+        visibility.map = level_map
+        visibility.areas = self.areas.copy()
+        visibility.cell_areas = self.cell_areas.copy()
+        visibility.links = list(self.links)
+        visibility.line_of_sight_cache = dict(self.line_of_sight_cache)
+        return visibility
+
+    def update(self):
+        """
+        Update the connections between areas if doors were opened or closed since the last update
+        """
+        open_doors = self.map.offset[self.door_slots] > 0
+        if self.open_doors is not None and np.array_equal(open_doors, self.open_doors):
+            return
+        self.open_doors = open_doors
+        self.line_of_sight_cache.clear()
+        # transitive closure of the adjacency matrix of areas linked by open doors
+        connected = np.eye(self.nb_areas, dtype=bool)
+        links = np.concatenate([self.door_areas[self.door_slots[open_doors]],
+                                np.array(self.links, dtype=np.int16).reshape(-1, 2)])
+        links = links[(links >= 0).all(axis=1)]
+        connected[links[:, 0], links[:, 1]] = True
+        connected[links[:, 1], links[:, 0]] = True
+        while True:
+            closure = (connected.astype(np.int32) @ connected.astype(np.int32)) > 0
+            if np.array_equal(closure, connected):
+                break
+            connected = closure
+        self.connected = connected
+
+    def add_link(self, area0, area1):
+        """
+        Permanently connect two areas (ignored if one of them is not an area)
+        :param area0: index of the first area
+        :param area1: index of the second area
+        """
+        if area0 >= 0 and area1 >= 0 and not self.connected[area0, area1]:
+            self.links.append((area0, area1))
+            self.open_doors = None
+            self.update()
+
+    def set_cell(self, x, y):
+        """
+        Update the area of a cell after its plane0 value changed (when a pushwall moves)
+        :param x: x-coordinate of the cell
+        :param y: y-coordinate of the cell
+        """
+        m0 = int(self.map.plane0[x, y])
+        area = m0 - AREA_TILE if m0 >= AREA_TILE else -1
+        self.areas[x, y] = self.cell_areas[x, y] = area
+        self.line_of_sight_cache.clear()
+
+    def visible_areas(self, x, y):
+        """
+        Areas that can be seen from a position
+        :param x: x-coordinate of the position
+        :param y: y-coordinate of the position
+        :return: array of booleans indexed by area (all True if the position has no area)
+        """
+        cx, cy = int(x), int(y)
+        area = self.cell_areas[cx, cy]
+        if area < 0:
+            return np.ones(self.nb_areas, dtype=bool)
+        visible = self.connected[area]
+        other_area = self.cell_other_areas[cx, cy]
+        if other_area >= 0:
+            visible = visible | self.connected[other_area]
+        return visible
+
+    def can_see(self, x, y, tx, ty):
+        """
+        Test if objects can possibly be seen from a position (objects in cells without area are considered visible)
+        :param x: x-coordinate of the position
+        :param y: y-coordinate of the position
+        :param tx: array of x-coordinates of the objects
+        :param ty: array of y-coordinates of the objects
+        :return: array of booleans
+        """
+        visible = self.visible_areas(x, y)
+        cx = np.asarray(tx).astype(np.intp)
+        cy = np.asarray(ty).astype(np.intp)
+        areas = self.cell_areas[cx, cy]
+        result = visible[areas] | (areas < 0)
+        other_areas = self.cell_other_areas[cx, cy]
+        with_other = other_areas >= 0
+        result[with_other] |= visible[other_areas[with_other]]
+        return result
+
+    def trace_line(self, x0, y0, x1, y1):
+        """
+        Walk through the cells crossed by the segment between the centers of two cells (stepping from cell to cell as
+        `engine.cast_ray` does) and test if any of them is a wall or a closed door
+        :param x0: x-coordinate of the first cell
+        :param y0: y-coordinate of the first cell
+        :param x1: x-coordinate of the second cell
+        :param y1: y-coordinate of the second cell
+        :return: whether no cell strictly between the two cells blocks the view
+        """
+        level_map = self.map
+        stepx = 1 if x1 >= x0 else -1
+        stepy = 1 if y1 >= y0 else -1
+        nx = abs(x1 - x0)
+        ny = abs(y1 - y0)
+        x, y = x0, y0
+        # ix, iy: number of vertical and horizontal cell borders crossed, the next vertical border is at a distance
+        # (2 * ix + 1) / (2 * nx) of the segment and the next horizontal border at (2 * iy + 1) / (2 * ny)
+        ix = iy = 0
+        while ix + iy < nx + ny - 1:
+            if (2 * ix + 1) * ny <= (2 * iy + 1) * nx:
+                ix += 1
+                x += stepx
+            else:
+                iy += 1
+                y += stepy
+            # walls and doors that are not open at all (kind 0 is for empty cells)
+            if level_map.kind[x, y] > 0:
+                slot = level_map.slot[x, y]
+                if slot < 0 or level_map.offset[slot] == 0:
+                    return False
+        return True
+
+    def line_of_sight(self, x0, y0, x1, y1):
+        """
+        Test if the centers of two cells can see each other (the segment between them does not cross any wall or
+        closed door). Results are cached until doors or pushwalls change.
+        :param x0: x-coordinate of the first cell
+        :param y0: y-coordinate of the first cell
+        :param x1: x-coordinate of the second cell
+        :param y1: y-coordinate of the second cell
+        :return: whether there is a line of sight between the cells
+        """
+        key = (x0, y0, x1, y1) if (x0, y0) <= (x1, y1) else (x1, y1, x0, y0)
+        result = self.line_of_sight_cache.get(key)
+        if result is None:
+            result = self.trace_line(*key)
+            self.line_of_sight_cache[key] = result
+        return result